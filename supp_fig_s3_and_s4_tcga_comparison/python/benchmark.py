@@ -0,0 +1,247 @@
+import os
+import math
+import time
+import json
+import shutil
+import argparse
+import resource
+import tracemalloc
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from release_generator import ReleaseGenerator
+from genie_analysis import GenieAnalysis
+from sql_backend import duckdb
+from comparison_results import ComparisonResults
+from tmb_analysis import TmbAnalysis
+
+# Sample counts benchmarked by default
+SIZES = [10000, 100000, 1000000]
+
+# GENIE_BACKEND values timed against the pandas backend, duckdb only when it is installed
+BACKENDS = ['sqlite', 'duckdb', 'matrix']
+
+# Largest release checked against the original per code implementations, they loop over every row
+REFERENCE_MAX_SAMPLES = 10000
+
+# Times and memory-profiles the release pipeline on synthetic releases, see ReleaseGenerator
+#
+# Each size gets its own release under /app/releases/synBENCH<samples>, steps are:
+#   generate, parse, encode, panel_filter, frequencies_rollup, frequencies_direct, frequencies_streaming,
+#   sample_counts, then frequencies_BACKEND and sample_counts_BACKEND for each of backends, metrics, tmb
+# Every backend's direct frequencies and sample counts are checked against the pandas backend's.
+# Up to REFERENCE_MAX_SAMPLES, the bulk frequencies and metrics are checked against the original per code
+# mutation_frequency_by_cancer_code and rmsd_by_cancer_type loops. Streaming frequencies are always checked against the bulk ones.
+#
+# Memory is the tracemalloc peak of each step, which covers numpy and pandas buffers but not pyarrow's
+# allocator, and the process max RSS after the step. Tracing slows Python heavy steps, pass memory=False for clean timings.
+# Results are written to /app/outputs/benchmarks/benchmark.tsv
+class Benchmark:
+    def __init__(self, sizes=SIZES, panels=20, density=8.0, seed=0, memory=True, keep=False, backends=BACKENDS):
+        load_dotenv(dotenv_path='/app/.env', verbose=True)
+        self.sizes = sizes
+        self.panels = panels
+        self.density = density
+        self.seed = seed
+        self.memory = memory
+        self.keep = keep
+        self.backends = [backend for backend in backends if backend != 'duckdb' or duckdb is not None]
+        if len(self.backends) < len(backends):
+            print("duckdb is not installed, skipping the duckdb backend")
+        self.rows = []
+        with open(os.getenv("CANCER_CODES_PATH")) as cc:
+            self.codes = [arr["genie_cancer_code"] for arr in json.load(cc)["cancer_codes"]]
+
+    # Run every size, returns a df of the step timings
+    def run(self):
+        for samples in self.sizes:
+            self.run_size(samples)
+        df = pd.DataFrame(self.rows, columns=['samples', 'step', 'seconds', 'peak_traced_mb', 'max_rss_mb', 'check'])
+        Path("/app/outputs/benchmarks").mkdir(parents=True, exist_ok=True)
+        df.to_csv("/app/outputs/benchmarks/benchmark.tsv", sep='\t', index=False)
+        print(df.to_string(index=False))
+        return df
+
+    # Benchmark a single release size
+    def run_size(self, samples):
+        release_id = f"synBENCH{samples}"
+        release_version = f"BENCH{samples}"
+        generator = ReleaseGenerator(release_id, release_version, samples, self.panels, self.density, self.seed)
+        self.measure(samples, 'generate', generator.generate)
+
+        try:
+            analysis = GenieAnalysis(release_id, release_version, use_cache=False)
+            parser = analysis.parser
+            self.measure(samples, 'parse', lambda: [parser.mutations_df, parser.samples_df, parser.patients_df, parser.panel_coverage_df])
+            self.measure(samples, 'encode', lambda: [parser.encoding, parser.encoded_samples, parser.encoded_mutations,
+                parser.sample_panel_codes, parser.panel_coverage_matrix])
+
+            encoded = parser.encoded_mutations
+            self.measure(samples, 'panel_filter', lambda: analysis.in_panel_codes(encoded['sample'].to_numpy(), encoded['gene'].to_numpy()))
+
+            frequencies = {}
+            for rollup, name in [[True, 'rollup'], [False, 'direct']]:
+                df = self.measure(samples, f"frequencies_{name}", lambda: analysis.mutation_frequency_by_cancer_codes(self.codes, rollup))
+                frequencies[rollup] = df
+                if samples <= REFERENCE_MAX_SAMPLES:
+                    self.check(f"frequencies_{name}", df, self.reference_frequencies(parser, df, rollup))
+
+            analysis.streaming = True
+            analysis.frequency_cache = {True: {}, False: {}}
+            df = self.measure(samples, 'frequencies_streaming', lambda: analysis.mutation_frequency_by_cancer_codes(self.codes, False))
+            self.check('frequencies_streaming', df, frequencies[False])
+
+            # The same analysis with each GENIE_BACKEND, see GenieAnalysis.mutation_frequency_by_cancer_codes
+            analysis.streaming = False
+            sample_counts = self.measure(samples, 'sample_counts', lambda: analysis.sample_count_by_cancer_type(False))
+            for backend in self.backends:
+                analysis.backend = backend
+                analysis.sql = None
+                analysis.matrix = None
+                analysis.frequency_cache = {True: {}, False: {}}
+                df = self.measure(samples, f"frequencies_{backend}", lambda: analysis.mutation_frequency_by_cancer_codes(self.codes, False))
+                self.check(f"frequencies_{backend}", df, frequencies[False])
+                if backend != 'matrix':
+                    df = self.measure(samples, f"sample_counts_{backend}", lambda: analysis.sample_count_by_cancer_type(False))
+                    self.check(f"sample_counts_{backend}", df, sample_counts)
+
+            results = self.comparison_results(frequencies[False])
+            metrics = self.measure(samples, 'metrics', lambda: [results.rmsd_by_gene(), results.rmsd_by_cancer_type()])
+            if samples <= REFERENCE_MAX_SAMPLES:
+                self.check('metrics', metrics[1][['rmsd', 'wrmsd']], self.reference_metrics(results))
+
+            self.measure(samples, 'tmb', lambda: TmbAnalysis(release_id, release_version, use_cache=False).tmb_by_sample())
+        finally:
+            if not self.keep:
+                shutil.rmtree(generator.release_dir, ignore_errors=True)
+
+    # Returns the value of fn, recording its time and memory
+    def measure(self, samples, step, fn):
+        print(f"Benchmarking {step} with {samples} samples...")
+        if self.memory:
+            tracemalloc.start()
+        start = time.time()
+        value = fn()
+        seconds = time.time() - start
+        peak = None
+        if self.memory:
+            peak = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+            tracemalloc.stop()
+        max_rss = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10, 1)
+        print(f"{step} took {seconds} seconds, peak traced memory {peak} MB, max RSS {max_rss} MB")
+        self.rows.append([samples, step, round(seconds, 3), peak, max_rss, ''])
+        return value
+
+    # Record whether a step's result matches its reference on the step's row
+    def check(self, step, df, reference):
+        df = df.reset_index(drop=True)
+        reference = reference.reset_index(drop=True)
+        try:
+            pd.testing.assert_frame_equal(df, reference, check_dtype=False)
+            result = 'ok'
+        except AssertionError as err:
+            print(f"{step} does not match its reference...")
+            print(err)
+            result = 'MISMATCH'
+        for row in self.rows:
+            if row[0] == self.rows[-1][0] and row[1] == step:
+                row[5] = result
+
+    # Returns mutation frequencies from the original per code implementation, one cancer code at a time
+    # Each cohort's SNPs are filtered to their panel with the row by row lookup in parser.sample_panels
+    # and parser.panel_genes and counted gene by gene, as mutation_frequency_by_cancer_code did before
+    # the bulk groupby. Rows ordered like df, restricted to df's (already rolled up) cancer codes
+    def reference_frequencies(self, parser, df, rollup=False):
+        target = 'ROLLUP_ONCOTREE_CODE' if rollup else 'ONCOTREE_CODE'
+        samples_df = parser.samples_df
+        mutations_df = parser.mutations_df
+        frames = []
+        for code in df.cancer_code.unique().tolist():
+            all_samples = samples_df.loc[samples_df[target] == code].SAMPLE_ID.unique().tolist()
+            all_mutations = mutations_df.loc[mutations_df['Tumor_Sample_Barcode'].isin(set(all_samples))]
+            all_mutations = all_mutations.loc[all_mutations['Variant_Type'] == 'SNP']
+
+            indecies_to_drop = [] # captures the row index where mutation gene is not in panel
+            for i, row in all_mutations.iterrows():
+                target_panel = parser.sample_panels[row['Tumor_Sample_Barcode']]
+                if row['Hugo_Symbol'] not in parser.panel_genes[target_panel]:
+                    indecies_to_drop.append(i)
+            all_mutations = all_mutations.drop(indecies_to_drop)
+
+            mutation_frequency = {}
+            for gene in all_mutations.Hugo_Symbol.unique().tolist():
+                target_mutations = all_mutations.loc[all_mutations['Hugo_Symbol'] == gene]
+                selected_samples = target_mutations.Tumor_Sample_Barcode.unique().tolist()
+                target_fraq = len(selected_samples) / len(all_samples)
+                mutation_frequency[gene] = [target_fraq, target_fraq*100, len(selected_samples), len(all_samples)]
+
+            code_df = pd.DataFrame.from_dict(mutation_frequency, orient="index").reset_index()
+            code_df.columns = ['Hugo_Symbol', 'genie_mut_fraq', 'genie_mut_freq', 'genie_gene_sample_count', 'genie_total_sample_count']
+            code_df.insert(0, 'cancer_code', code)
+            frames.append(code_df)
+
+        reference = pd.concat(frames, ignore_index=True)
+        reference = df[['cancer_code', 'Hugo_Symbol']].astype(str).merge(reference, on=['cancer_code', 'Hugo_Symbol'], how='outer')
+        return reference[df.columns]
+
+    # Returns comparison results against a synthetic TCGA cohort drawn around the GENIE frequencies
+    def comparison_results(self, frequencies):
+        rng = np.random.RandomState(self.seed)
+        results = ComparisonResults()
+        for code, genie_df in frequencies.groupby('cancer_code', sort=False):
+            total = rng.randint(50, 1000)
+            counts = rng.binomial(total, genie_df.genie_mut_fraq.to_numpy())
+            result = pd.DataFrame({
+                'Hugo_Symbol': genie_df.Hugo_Symbol.to_numpy(),
+                'tcga_mut_fraq': counts / total,
+                'tcga_mut_freq': counts / total * 100,
+                'tcga_gene_sample_count': counts,
+                'tcga_total_sample_count': total
+            }).merge(genie_df.drop(columns='cancer_code'), on='Hugo_Symbol')
+            results.add(code, code, result)
+        return results
+
+    # Returns rmsd and wrmsd per cohort from the original rmsd_by_cancer_type row loop
+    def reference_metrics(self, results):
+        rows = []
+        for tcga_cancer_code, genie_cancer_code in results.cohorts:
+            err = []
+            weighted_err = []
+            for i, row in results.cohort(genie_cancer_code).iterrows():
+                mut_freq_x = row['tcga_mut_freq']
+                mut_freq_y = row['genie_mut_freq']
+
+                # calculate absolute distance from point to y=x
+                if mut_freq_y == mut_freq_x:
+                    err.append(0)
+                    weighted_err.append(0)
+                elif mut_freq_x > mut_freq_y:
+                    hyp = mut_freq_x - mut_freq_y
+                    opp = hyp * math.sin(math.radians(45))
+                    err.append(opp)
+                    weighted_err.append(opp*mut_freq_x/100)
+                elif mut_freq_y > mut_freq_x:
+                    hyp = mut_freq_y - mut_freq_x
+                    adj = hyp * math.cos(math.radians(45))
+                    err.append(adj)
+                    weighted_err.append(adj*mut_freq_y/100)
+            if len(err) == 0:
+                rows.append([np.nan, np.nan])
+                continue
+            mse = sum([x**2 for x in err]) / len(err)
+            weighted_mse = sum([x**2 for x in weighted_err]) / len(weighted_err)
+            rows.append([round(mse**0.5, 2), round(weighted_mse**0.5, 2)])
+        return pd.DataFrame(rows, columns=['rmsd', 'wrmsd'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the release pipeline on synthetic releases")
+    parser.add_argument("--samples", type=int, nargs='+', default=SIZES)
+    parser.add_argument("--panels", type=int, default=20)
+    parser.add_argument("--density", type=float, default=8.0, help="mean mutations per sample")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip tracemalloc for clean timings")
+    parser.add_argument("--keep", action="store_true", help="keep the generated releases")
+    parser.add_argument("--backends", nargs='*', default=BACKENDS, choices=BACKENDS, help="GENIE_BACKEND values compared with pandas")
+    args = parser.parse_args()
+    Benchmark(args.samples, args.panels, args.density, args.seed, args.memory, args.keep, args.backends).run()
@@ -0,0 +1,104 @@
+import pandas as pd
+from deviation_metrics import DeviationMetrics
+
+# Columns of a merged TCGA/GENIE comparison frame, see TcgaGenieComparison.frequency_count_data
+RESULT_TYPES = {
+    'Hugo_Symbol': 'object',
+    'tcga_mut_fraq': 'float64',
+    'tcga_mut_freq': 'float64',
+    'tcga_gene_sample_count': 'int64',
+    'tcga_total_sample_count': 'int64',
+    'genie_mut_fraq': 'float64',
+    'genie_mut_freq': 'float64',
+    'genie_gene_sample_count': 'int64',
+    'genie_total_sample_count': 'int64',
+}
+RESULT_COLUMNS = list(RESULT_TYPES.keys())
+COHORT_COLUMNS = ['tcga_cancer_code', 'genie_cancer_code']
+# Kept when the frequencies have them, see GenieAnalysis.panel_denominators and FrequencyIntervals
+OPTIONAL_TYPES = {
+    'genie_covered_sample_count': 'int64',
+    'tcga_mut_freq_lower': 'float64',
+    'tcga_mut_freq_upper': 'float64',
+    'genie_mut_freq_lower': 'float64',
+    'genie_mut_freq_upper': 'float64',
+}
+
+# Returns RESULT_COLUMNS followed by the optional columns present in df
+def result_columns(df):
+    return RESULT_COLUMNS + [column for column in OPTIONAL_TYPES if column in df.columns]
+
+# In memory store of the comparison results for every cohort
+# Holds one long typed table keyed by tcga_cancer_code and genie_cancer_code; per-gene and per-cohort
+# metrics and the raw_data TSVs are all computed from it, independent of what is on disk
+class ComparisonResults:
+    def __init__(self):
+        self.cohorts = []
+        self.frames = []
+        self.cached_table = None
+
+    # Returns results rebuilt from a table, ex. a checkpointed ComparisonResults.table
+    # cohorts is a list of [tcga_cancer_code, genie_cancer_code] in the original order
+    @classmethod
+    def from_table(self, cohorts, table):
+        results = self()
+        results.cohorts = [list(cohort) for cohort in cohorts]
+        results.frames = [table[COHORT_COLUMNS + result_columns(table)]]
+        return results
+
+    # Add the merged comparison frame of a cohort, copied so later edits by callers do not leak in
+    def add(self, tcga_cancer_code, genie_cancer_code, result):
+        frame = result[result_columns(result)].copy()
+        frame.insert(0, 'genie_cancer_code', genie_cancer_code)
+        frame.insert(0, 'tcga_cancer_code', tcga_cancer_code)
+        self.cohorts.append([tcga_cancer_code, genie_cancer_code])
+        self.frames.append(frame)
+        self.cached_table = None
+
+    # Returns the long table of every cohort's results
+    @property
+    def table(self):
+        if self.cached_table is None:
+            if len(self.frames) > 0:
+                table = pd.concat(self.frames, ignore_index=True)
+            else:
+                table = pd.DataFrame(columns=COHORT_COLUMNS + RESULT_COLUMNS)
+            for column in COHORT_COLUMNS:
+                table[column] = table[column].astype('category')
+            self.cached_table = table.astype({**RESULT_TYPES, **{column: OPTIONAL_TYPES[column] for column in result_columns(table)[len(RESULT_COLUMNS):]}})
+        return self.cached_table
+
+    # Returns the results of a cohort in the original merged layout
+    def cohort(self, genie_cancer_code):
+        table = self.table
+        result = table[table.genie_cancer_code == genie_cancer_code]
+        return result[result_columns(result)].reset_index(drop=True)
+
+    # Write a cohort's results to {outpath}/raw_data
+    def write_cohort(self, outpath, genie_cancer_code):
+        self.cohort(genie_cancer_code).to_csv(f"{outpath}/raw_data/{genie_cancer_code}_results.tsv", sep='\t', index=True)
+
+    # Returns rmsd, wrmsd, error_sum and cancer_type_count per gene across all cohorts
+    def rmsd_by_gene(self):
+        print(f"Calculating RMSD and wRMSD by gene.")
+        metrics = DeviationMetrics.by_group(self.table, ['Hugo_Symbol'])
+        metrics.columns = ['gene', 'rmsd', 'wrmsd', 'error_sum', 'cancer_type_count']
+        return metrics
+
+    # Returns rmsd and wrmsd per cohort, nan for cohorts without results
+    def rmsd_by_cancer_type(self):
+        cohorts = pd.DataFrame(self.cohorts, columns=COHORT_COLUMNS)
+        table = self.table.astype({column: 'object' for column in COHORT_COLUMNS})
+        metrics = DeviationMetrics.by_group(table, COHORT_COLUMNS)
+        return cohorts.merge(metrics, on=COHORT_COLUMNS, how='left')[COHORT_COLUMNS + ['rmsd', 'wrmsd']]
+
+    # Returns [genie_cancer_code, tcga_total_sample_count, genie_total_sample_count] for cohorts with results
+    def sample_counts(self):
+        counts = []
+        for tcga_cancer_code, genie_cancer_code in self.cohorts:
+            result = self.cohort(genie_cancer_code)
+            if len(result) == 0:
+                print(f"Unable to parse out sample counts for {tcga_cancer_code}")
+                continue
+            counts.append([genie_cancer_code, result.tcga_total_sample_count.iat[0], result.genie_total_sample_count.iat[0]])
+        return counts
@@ -0,0 +1,56 @@
+import math
+import numpy as np
+import pandas as pd
+
+# Points below y=x are projected with sin, points above with cos, as in the original per-row loops
+# The two differ in the last bit, so both are kept to reproduce earlier results exactly
+SIN_45 = math.sin(math.radians(45))
+COS_45 = math.cos(math.radians(45))
+
+# RMSD, weighted RMSD and error sums of TCGA vs. GENIE mutation frequencies
+# Computed in one pass over a long frequency table for any grouping, ex. by cohort, by gene or both
+class DeviationMetrics:
+
+    # Returns the distance from each point to y=x and the distance weighted by the larger frequency
+    @classmethod
+    def errors(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        err = np.where(x > y, (x - y)*SIN_45, (y - x)*COS_45)
+        weighted_err = err*np.maximum(x, y)/100
+        return err, weighted_err
+
+    # Returns a df of rmsd, wrmsd, error_sum and count per group, groups in order of first appearance
+    # rmsd and wrmsd are rounded to 2 decimals
+    # mse = (1/n) * sum[ (acual - pred)**2 ]
+    # rmsd = sqrt(mse)
+    # Rows missing either frequency are skipped
+    @classmethod
+    def by_group(self, df, keys, x='tcga_mut_freq', y='genie_mut_freq'):
+        df = df[df[x].notna() & df[y].notna()]
+        err, weighted_err = self.errors(df[x], df[y])
+        if len(keys) > 0:
+            groups = df.groupby(keys, sort=False).ngroup().to_numpy()
+            metrics = df[keys].drop_duplicates().reset_index(drop=True)
+        else:
+            groups = np.zeros(len(df), dtype=np.int64)
+            metrics = pd.DataFrame(index=range(1))
+
+        # bincount adds each group's values in row order, like the builtin sum
+        count = np.bincount(groups, minlength=len(metrics))
+        error_sum = np.bincount(groups, weights=err, minlength=len(metrics))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mse = np.bincount(groups, weights=err**2, minlength=len(metrics)) / count
+            weighted_mse = np.bincount(groups, weights=weighted_err**2, minlength=len(metrics)) / count
+
+        metrics['rmsd'] = [round(value**0.5, 2) for value in mse.tolist()]
+        metrics['wrmsd'] = [round(value**0.5, 2) for value in weighted_mse.tolist()]
+        metrics['error_sum'] = error_sum
+        metrics['count'] = count
+        return metrics
+
+    # Returns rmsd, wrmsd for a single merged comparison frame, nan when there is nothing to compare
+    @classmethod
+    def rmsd(self, df, x='tcga_mut_freq', y='genie_mut_freq'):
+        metrics = self.by_group(df, [], x, y)
+        return metrics.rmsd.iat[0], metrics.wrmsd.iat[0]
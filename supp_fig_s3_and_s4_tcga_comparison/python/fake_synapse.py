@@ -0,0 +1,84 @@
+import os
+import hashlib
+import threading
+
+FILE_TYPE = "org.sagebionetworks.repo.model.FileEntity"
+FOLDER_TYPE = "org.sagebionetworks.repo.model.Folder"
+
+# Entity returned by FakeSynapse.get, with the attributes SynapseGateway reads
+class FakeEntity:
+    def __init__(self, id, name, version, data):
+        self.id = id
+        self.name = name
+        self.versionNumber = version
+        self._file_handle = {"contentMd5": hashlib.md5(data).hexdigest(), "contentSize": len(data)}
+        self.path = None
+
+# In memory stand-in for a logged in synapseclient.Synapse, for SynapseGateway(client=FakeSynapse())
+# Only getChildren and get are implemented. Downloads can be made to fail, see the fault sets:
+#   corrupt      file ids downloaded with an extra byte, so their MD5 does not match
+#   fail         file ids whose download raises before writing anything
+#   interrupt    file ids whose download writes half the file to downloadLocation, then raises
+# A download finding a partial file in downloadLocation appends the rest, like synapseclient, and is recorded in resumed
+class FakeSynapse:
+    def __init__(self):
+        self.children = {} # folder id -> list of child dicts
+        self.files = {} # file id -> (name, bytes)
+        self.versions = {} # file id -> version number
+        self.corrupt = set()
+        self.fail = set()
+        self.interrupt = set()
+        self.downloads = [] # names of every download attempt
+        self.resumed = [] # names of downloads that continued a partial file
+        self.lock = threading.Lock()
+
+    # Adds a folder under parent, parent None for the release root
+    def add_folder(self, parent, folder_id, name=None):
+        self.children.setdefault(folder_id, [])
+        if parent is not None:
+            self.children.setdefault(parent, []).append({"id": folder_id, "name": name or folder_id, "type": FOLDER_TYPE})
+
+    # Adds a file under a folder, returns its id
+    def add_file(self, parent, name, data, version=1):
+        file_id = f"syn{len(self.files) + 1}"
+        self.files[file_id] = (name, data)
+        self.versions[file_id] = version
+        self.children.setdefault(parent, []).append({"id": file_id, "name": name, "type": FILE_TYPE})
+        return file_id
+
+    # Replaces the contents of a file, bumping its version
+    def update_file(self, file_id, data):
+        name = self.files[file_id][0]
+        self.files[file_id] = (name, data)
+        self.versions[file_id] += 1
+
+    def getChildren(self, parent, includeTypes=None):
+        return iter(list(self.children[parent]))
+
+    def get(self, entity, version=None, downloadFile=True, downloadLocation=None, ifcollision=None, followLink=False):
+        name, data = self.files[entity]
+        file = FakeEntity(entity, name, self.versions[entity], data)
+        if not downloadFile:
+            return file
+
+        with self.lock:
+            self.downloads.append(name)
+        if entity in self.fail:
+            raise IOError(f"Download of {name} failed")
+
+        path = os.path.join(downloadLocation, name)
+        written = os.path.getsize(path) if os.path.isfile(path) else 0
+        if written > 0:
+            with self.lock:
+                self.resumed.append(name)
+        if entity in self.interrupt:
+            with open(path, "wb") as f:
+                f.write(data[:len(data) // 2])
+            raise IOError(f"Download of {name} was interrupted")
+
+        with open(path, "ab" if 0 < written <= len(data) else "wb") as f:
+            f.write(data[written:] if 0 < written <= len(data) else data)
+            if entity in self.corrupt:
+                f.write(b"x")
+        file.path = path
+        return file
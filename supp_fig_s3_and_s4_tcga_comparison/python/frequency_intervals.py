@@ -0,0 +1,147 @@
+import os
+import numpy as np
+from scipy.special import ndtri, betaincinv
+
+# Cells of replicate x sample data drawn at a time by the bootstrap, bounds its memory
+BOOTSTRAP_BATCH_CELLS = 1 << 23
+
+# Confidence intervals of mutation frequencies
+#   wilson           Wilson score interval of count/total
+#   clopper_pearson  exact binomial interval of count/total
+#   bootstrap        percentile interval over resampled cohorts
+# Intervals are fractions, callers scale them to percents like the _mut_freq columns
+#
+# FREQUENCY_INTERVALS  method, unset for no intervals
+# INTERVAL_CONFIDENCE  ex. 0.95
+# BOOTSTRAP_REPLICATES number of resampled cohorts
+# BOOTSTRAP_SEED       seed of the resampling, fixed so reruns give the same intervals
+class FrequencyIntervals:
+    def __init__(self, method=None, confidence=None, replicates=None, seed=None):
+        self.method = method or os.getenv('FREQUENCY_INTERVALS') or None
+        self.confidence = confidence or float(os.getenv('INTERVAL_CONFIDENCE', 0.95))
+        self.replicates = replicates or int(os.getenv('BOOTSTRAP_REPLICATES', 1000))
+        self.seed = seed if seed != None else int(os.getenv('BOOTSTRAP_SEED', 0))
+        if self.method not in [None, 'wilson', 'clopper_pearson', 'bootstrap']:
+            raise ValueError(f"Unknown interval method {self.method}, use wilson, clopper_pearson or bootstrap")
+
+    # Settings that change the intervals, ex. for stage params
+    def params(self):
+        return {"method": self.method, "confidence": self.confidence, "replicates": self.replicates, "seed": self.seed}
+
+    # Returns lower and upper bounds of count/total for aggregate counts
+    # Without per sample data bootstrap draws each count from Binomial(total, count/total),
+    # the per gene distribution of resampling the cohort's samples
+    # Raises a ValueError when a count is larger than its total, count/total is then not a proportion
+    def binomial(self, counts, totals):
+        counts = np.asarray(counts, dtype=float)
+        totals = np.asarray(totals, dtype=float)
+        if (counts > totals).any():
+            rows = np.flatnonzero(counts > totals)
+            raise ValueError(f"{len(rows)} counts are larger than their totals, ex. {int(counts[rows[0]])} of {int(totals[rows[0]])}")
+        if self.method == 'wilson':
+            return self.wilson(counts, totals)
+        if self.method == 'clopper_pearson':
+            return self.clopper_pearson(counts, totals)
+        return self.binomial_bootstrap(counts, totals)
+
+    def wilson(self, counts, totals):
+        z = ndtri(1 - (1 - self.confidence) / 2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            p = counts / totals
+            center = (p + z**2 / (2*totals)) / (1 + z**2 / totals)
+            half = z / (1 + z**2 / totals) * np.sqrt(p*(1 - p) / totals + z**2 / (4*totals**2))
+        return np.clip(center - half, 0, 1), np.clip(center + half, 0, 1)
+
+    def clopper_pearson(self, counts, totals):
+        alpha = 1 - self.confidence
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lower = np.where(counts > 0, betaincinv(counts, totals - counts + 1, alpha / 2), 0.0)
+            upper = np.where(counts < totals, betaincinv(counts + 1, totals - counts, 1 - alpha / 2), 1.0)
+        return lower, upper
+
+    # Every replicate of every count is drawn in one binomial call
+    def binomial_bootstrap(self, counts, totals):
+        rng = np.random.RandomState(self.seed)
+        totals = totals.astype(np.int64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            p = np.clip(np.nan_to_num(counts / totals), 0, 1)
+            draws = rng.binomial(totals, p, size=(self.replicates, len(counts))) / np.maximum(totals, 1)
+        return self.percentiles(draws)
+
+    # Returns lower and upper bounds of per (cohort, gene) frequencies by resampling each cohort's samples
+    #   matrix          MutationMatrix of the samples
+    #   members         matrix rows in the cohorts, cohorts the cohort index of each member
+    #   key_cohorts     cohort index of each output row, key_genes its gene code
+    #   member_panels   panel code of each member and coverage the panel x gene coverage matrix,
+    #                   to divide by covered samples as with GenieAnalysis.panel_denominators
+    #
+    # Each replicate draws every cohort's size in members with replacement. Batches of replicates are drawn
+    # together as a replicate x member weight array, and every (cohort, gene) count of the batch is one
+    # weighted sum over the matrix entries of the members
+    def bootstrap(self, matrix, members, cohorts, key_cohorts, key_genes, member_panels=None, coverage=None):
+        if len(key_cohorts) == 0:
+            return np.zeros(0), np.zeros(0)
+        rng = np.random.RandomState(self.seed)
+        order = np.argsort(cohorts, kind='stable')
+        members = members[order]
+        cohorts = cohorts[order]
+        cohort_count = int(max(cohorts.max(initial=-1), key_cohorts.max(initial=-1))) + 1
+        gene_count = matrix.shape[1]
+        sizes = np.bincount(cohorts, minlength=cohort_count)
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+        # Matrix entries of the members, (member, gene), sorted by the output row they count towards
+        row_counts = matrix.row_counts()[members]
+        entry_members = np.repeat(np.arange(len(members)), row_counts)
+        starts = np.repeat(matrix.indptr[members] - np.concatenate([[0], np.cumsum(row_counts)[:-1]]), row_counts)
+        entry_genes = matrix.indices[starts + np.arange(len(entry_members))]
+        key_codes = key_cohorts.astype(np.int64)*gene_count + key_genes
+        key_order = np.argsort(key_codes, kind='stable')
+        entry_codes = cohorts[entry_members].astype(np.int64)*gene_count + entry_genes
+        position = np.minimum(np.searchsorted(key_codes[key_order], entry_codes), len(key_codes) - 1)
+        found = key_codes[key_order][position] == entry_codes
+        entry_keys = key_order[position[found]]
+        entry_members = entry_members[found]
+        entry_order = np.argsort(entry_keys, kind='stable')
+        entry_keys = entry_keys[entry_order]
+        entry_members = entry_members[entry_order]
+        counted_keys, key_starts = np.unique(entry_keys, return_index=True)
+
+        if member_panels is not None:
+            panel_count = coverage.shape[0]
+            covered_members = member_panels[order] >= 0
+            member_cells = cohorts[covered_members]*panel_count + member_panels[order][covered_members]
+            coverage = coverage.astype(np.float64)
+
+        fractions = np.empty((self.replicates, len(key_codes)), dtype=np.float32)
+        batch = max(1, BOOTSTRAP_BATCH_CELLS // max(len(entry_members), len(members), 1))
+        for start in range(0, self.replicates, batch):
+            size = min(batch, self.replicates - start)
+            picks = offsets[cohorts] + (rng.random_sample((size, len(members))) * sizes[cohorts]).astype(np.int64)
+            weights = np.bincount((np.arange(size)[:, None]*len(members) + picks).ravel(), minlength=size*len(members))
+            weights = weights.reshape(size, len(members))
+
+            counts = np.zeros((size, len(key_codes)))
+            if len(entry_members) > 0:
+                counts[:, counted_keys] = np.add.reduceat(weights[:, entry_members], key_starts, axis=1)
+            if member_panels is None:
+                totals = sizes[key_cohorts][None, :]
+            else:
+                cells = (np.arange(size)[:, None]*cohort_count*panel_count + member_cells[None, :]).ravel()
+                cells = np.bincount(cells, weights=weights[:, covered_members].ravel(), minlength=size*cohort_count*panel_count)
+                covered = cells.reshape(size, cohort_count, panel_count) @ coverage
+                totals = covered[:, key_cohorts, key_genes]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                fractions[start:start + size] = np.where(totals > 0, counts / totals, np.nan)
+        return self.percentiles(fractions)
+
+    # Returns the percentile interval of replicate x value draws, ignoring undefined draws
+    def percentiles(self, draws):
+        alpha = 1 - self.confidence
+        if len(draws) == 0 or draws.shape[1] == 0:
+            return np.zeros(draws.shape[1]), np.zeros(draws.shape[1])
+        if np.isnan(draws).any():
+            lower, upper = np.nanpercentile(draws, [100*alpha / 2, 100*(1 - alpha / 2)], axis=0)
+        else:
+            lower, upper = np.percentile(draws, [100*alpha / 2, 100*(1 - alpha / 2)], axis=0)
+        return lower.astype(np.float64), upper.astype(np.float64)
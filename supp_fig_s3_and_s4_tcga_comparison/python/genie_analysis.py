@@ -1,9 +1,14 @@
 import os
 import sys
 import json
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
-from release_parser import ReleaseParser
+from release_parser import ReleaseParser, MUTATION_COLUMNS, STREAM_BLOCK_SIZE
+from run_report import REPORT
+from sql_backend import SqlBackend
+from mutation_matrix import MutationMatrix
+from frequency_intervals import FrequencyIntervals
 
 ### Original GENIE Query
 #
@@ -30,26 +35,64 @@ from release_parser import ReleaseParser
 
 # Parses txt files from consortium releases into usable data structures
 class GenieAnalysis:
-    def __init__(self, release_id=None, release_version=None):
+    def __init__(self, release_id=None, release_version=None, use_cache=True, engine="pyarrow", mutation_columns=MUTATION_COLUMNS, streaming=False, backend=None, panel_denominators=None, intervals=None):
         load_dotenv(dotenv_path='/app/.env', verbose=True)
         self.release_id = release_id #ex. synXXX
         self.release_version = release_version #ex. 10.2
+        self.streaming = streaming # stream the MAF instead of loading mutations_df
+        self.backend = backend or os.getenv("GENIE_BACKEND") or "pandas" # 'pandas', 'matrix' for MutationMatrix, or 'duckdb'/'sqlite' for SqlBackend
+        self.sql = None
+        self.matrix = None
+        # Divide each gene's count by the cohort samples whose panel covers the gene instead of every cohort sample
+        self.panel_denominators = panel_denominators
+        if self.panel_denominators == None:
+            self.panel_denominators = str(os.getenv('GENIE_PANEL_DENOMINATORS')).lower() == 'true'
+        self.intervals = FrequencyIntervals(intervals) # adds genie_mut_freq_lower/upper when FREQUENCY_INTERVALS is set
 
         if self.release_id == None:
             self.release_id = os.getenv("SYNAPSE_RELEASE_ID")
         if self.release_version == None:
             self.release_version = os.getenv("SYNAPSE_RELEASE_VERSION")
             
-        self.parser = ReleaseParser(self.release_id, self.release_version)
+        self.parser = ReleaseParser(self.release_id, self.release_version, use_cache, engine, mutation_columns)
 
-        # Parse input files
-        self.mutations_df = self.parser.mutations_df
-        self.samples_df = self.parser.samples_df
-        self.patients_df = self.parser.patients_df
-        self.cancer_codes = self.parser.cancer_codes
-        self.panel_genes = self.parser.panel_genes
-        self.sample_panels = self.parser.sample_panels
-        self.oncotree_codes = self.parser.oncotree_codes
+        # Bulk mutation frequency results
+        # Key = rollup flag
+        # Value = dict of cancer code to mutation frequency df
+        self.frequency_cache = {True: {}, False: {}}
+
+    # Release artifacts are parsed on first access by the parser
+    @property
+    def mutations_df(self):
+        return self.parser.mutations_df
+
+    @property
+    def samples_df(self):
+        return self.parser.samples_df
+
+    @property
+    def patients_df(self):
+        return self.parser.patients_df
+
+    @property
+    def cancer_codes(self):
+        return self.parser.cancer_codes
+
+    @property
+    def panel_genes(self):
+        return self.parser.panel_genes
+
+    @property
+    def sample_panels(self):
+        return self.parser.sample_panels
+
+    @property
+    def oncotree_codes(self):
+        return self.parser.oncotree_codes
+
+    @property
+    def oncotree_index(self):
+        return self.parser.oncotree_index
 
     # Returns a list of unique genes in the release
     def unique_genes(self):
@@ -82,6 +125,16 @@ class GenieAnalysis:
             rollup_code = code
         return rollup_code
 
+    # Returns the OncoTree ancestor of a code at the given level, 1 = tissue
+    # Unlike oncotree_rollup_code this follows the OncoTree hierarchy, not the curated GENIE rollup
+    def oncotree_level_code(self, code, level):
+        return self.oncotree_index.ancestor_at_level(code, level)
+
+    # Returns a list of unique samples whose oncotree code rolls up to code at the given level
+    def unique_samples_by_oncotree_level(self, code, level):
+        samples = self.samples_df.loc[self.parser.oncotree_level_codes(level) == code]
+        return samples.SAMPLE_ID.unique().tolist()
+
     # Returns a list of unique samples by a given cancer code  
     def unique_samples_by_cancer_code(self, code, rollup=False):
         if rollup:
@@ -97,23 +150,39 @@ class GenieAnalysis:
         all_mutations = self.mutations_df.loc[self.mutations_df['Tumor_Sample_Barcode'].isin(samples)]
         return all_mutations.loc[all_mutations['Variant_Type'] == 'SNP']
 
+    # Returns a boolean mask over a mutations df
+    # True where the mutation gene is covered by the sample's panel
+    def in_panel_mask(self, mutations):
+        encoded = self.parser.encode_mutations(mutations)
+        mask = self.in_panel_codes(encoded['sample'].to_numpy(), encoded['gene'].to_numpy())
+        return pd.Series(mask, index=mutations.index)
+
+    # Returns a boolean array over int coded (sample, gene) pairs
+    # True where the gene is covered by the sample's panel
+    def in_panel_codes(self, samples, genes):
+        panels = self.sample_panel_codes(samples)
+        covered = (panels >= 0) & (genes >= 0)
+        mask = np.zeros(len(samples), dtype=bool)
+        mask[covered] = self.parser.panel_coverage_matrix[panels[covered], genes[covered]]
+        return mask
+
+    # Returns the panel code of each int coded sample, -1 for unmapped samples (code -1) and samples without a panel
+    def sample_panel_codes(self, samples):
+        samples = np.asarray(samples)
+        panels = np.full(len(samples), -1, dtype=self.parser.sample_panel_codes.dtype)
+        mapped = samples >= 0
+        panels[mapped] = self.parser.sample_panel_codes[samples[mapped]]
+        return panels
+
     # Returns a df of mutations by cancer code
     # Checks the the mutation gene is in the associated panel
     def mutations_in_panel(self, code, rollup=False):
         print(f"Returning mutations in panel for cancer code: {code}")
         all_mutations = self.mutations_by_cancer_code(code, rollup)
         print(f"All cases has shape of {all_mutations.shape}")
-        indecies_to_drop = [] # captures the row index where mutation gene is not in panel  
-        for i, row in all_mutations.iterrows():
-            target_gene = row['Hugo_Symbol']
-            target_sample = row['Tumor_Sample_Barcode']
-            target_panel = self.parser.sample_panels[target_sample]
-            panel_genes = self.parser.panel_genes[target_panel]
-            if target_gene not in panel_genes:
-                indecies_to_drop.append(i) # Add to drop list
-
-        all_mutations.drop(indecies_to_drop, inplace=True)
-        print(f"Removed {len(indecies_to_drop)} mutations not listed in panel")
+        in_panel = self.in_panel_mask(all_mutations)
+        all_mutations = all_mutations.loc[in_panel]
+        print(f"Removed {int((~in_panel).sum())} mutations not listed in panel")
         print(f"Filtered cases has shape of {all_mutations.shape}")
         return all_mutations.loc[all_mutations['Variant_Type'] == 'SNP']
 
@@ -121,6 +190,7 @@ class GenieAnalysis:
     # divided by the total number of samples for a given cancer type
     #
     # Returns a df of mutations frequencies for a given cancer code
+    # Slices the bulk results, computing them for this code if not cached
     def mutation_frequency_by_cancer_code(self, code, rollup=False):
         print(f"Beginning calculation of GENIE mutation frequency for {code}")
 
@@ -128,26 +198,278 @@ class GenieAnalysis:
             print(f"Fetching rollup code for: {code}")
             code = self.oncotree_rollup_code(code)
 
-        # Key = Hugo_Symbol
-        # Val = mut_freq
-        mutation_frequency = {}
+        if code not in self.frequency_cache[rollup]:
+            self.mutation_frequency_by_cancer_codes([code], rollup)
+        return self.frequency_cache[rollup][code].copy()
+
+    # Returns a long df of mutation frequencies for a list of cancer codes
+    # All codes are computed with a single groupby over (cancer_code, Hugo_Symbol, sample)
+    # Per code results are cached for mutation_frequency_by_cancer_code
+    def mutation_frequency_by_cancer_codes(self, codes, rollup=False):
+        with REPORT.measure("frequencies", "genie_rollup" if rollup else "genie_direct") as record:
+            if self.streaming:
+                df = self.mutation_frequency_by_cancer_codes_streaming(codes, rollup)
+            elif self.backend == "matrix":
+                df = self.mutation_frequency_by_cancer_codes_matrix(codes, rollup)
+            elif self.backend != "pandas":
+                df = self.mutation_frequency_by_cancer_codes_sql(codes, rollup)
+            else:
+                print(f"Beginning bulk calculation of GENIE mutation frequency for {len(codes)} cancer codes")
+                codes, cohorts = self.cancer_code_cohorts(codes, rollup)
+                snps = self.cohort_snps(self.parser.encoded_mutations, cohorts['sample'].to_numpy())
+                df = self.frequency_table(codes, cohorts, snps, rollup)
+            record["rows"] = len(df)
+        return df
+
+    # Same results as mutation_frequency_by_cancer_codes without loading the full MAF
+    # Reads the MAF in blocks of block_size bytes and keeps each block's distinct (sample, gene) SNP pairs
+    # of the requested cohorts, pairs repeated across blocks are dropped once after the last block
+    def mutation_frequency_by_cancer_codes_streaming(self, codes, rollup=False, block_size=STREAM_BLOCK_SIZE):
+        print(f"Beginning streaming calculation of GENIE mutation frequency for {len(codes)} cancer codes")
+        codes, cohorts = self.cancer_code_cohorts(codes, rollup)
+        samples = cohorts['sample'].to_numpy()
+
+        pairs = [pd.DataFrame({'gene': np.array([], dtype=np.int32), 'sample': np.array([], dtype=np.int32)})]
+        columns = ['Hugo_Symbol', 'Tumor_Sample_Barcode', 'Variant_Type']
+        for chunk in self.parser.iter_release_file(self.parser.mutations_path, columns, block_size):
+            pairs.append(self.cohort_snps(self.parser.encode_mutations(chunk), samples).drop_duplicates())
+        pairs = pd.concat(pairs, ignore_index=True).drop_duplicates()
+        return self.frequency_table(codes, cohorts, pairs, rollup)
+
+    # Same results as mutation_frequency_by_cancer_codes from a set based query, see SqlBackend
+    def mutation_frequency_by_cancer_codes_sql(self, codes, rollup=False):
+        print(f"Beginning {self.backend} calculation of GENIE mutation frequency for {len(codes)} cancer codes")
+        codes = self.resolve_codes(codes, rollup)
+        df = self.sql_backend().mutation_counts(codes, rollup)
+
+        # Rows in the same order as the pandas path, by encoded cancer code then gene
+        order = np.lexsort((self.parser.encode('gene', df['Hugo_Symbol']), self.parser.encode('oncotree_code', df['cancer_code'])))
+        df = df.iloc[order].reset_index(drop=True)
+        df['genie_gene_sample_count'] = df.genie_gene_sample_count.astype(np.int64)
+        df['genie_total_sample_count'] = df.genie_total_sample_count.astype(np.int64)
+        df['genie_mut_fraq'] = df.genie_gene_sample_count / df.genie_total_sample_count
+        df['genie_mut_freq'] = df.genie_mut_fraq*100
+        df = df[['cancer_code', 'Hugo_Symbol', 'genie_mut_fraq', 'genie_mut_freq', 'genie_gene_sample_count', 'genie_total_sample_count']]
+        return self.frequency_results(codes, df, rollup)
+
+    # Same results as mutation_frequency_by_cancer_codes as a column sum of the mutation matrix per cohort
+    def mutation_frequency_by_cancer_codes_matrix(self, codes, rollup=False):
+        print(f"Beginning matrix calculation of GENIE mutation frequency for {len(codes)} cancer codes")
+        codes = self.resolve_codes(codes, rollup)
+        target = 'rollup_code' if rollup else 'oncotree_code'
+        code_ids = self.parser.encoding['oncotree_code'].get_indexer(codes)
+        cohort_codes = self.parser.encoded_samples[target].to_numpy()
+        unique_rows = self.unique_sample_rows()
+
+        dfs = [self.cohort_counts(np.zeros(len(cohort_codes), dtype=bool)).assign(cancer_code='')] # typed columns when no code has rows
+        for code_id in np.unique(code_ids[code_ids >= 0]): # encoded order, as the pandas path groups
+            dfs.append(self.cohort_counts((cohort_codes == code_id) & unique_rows).assign(cancer_code=self.parser.encoding['oncotree_code'][code_id]))
+        df = pd.concat(dfs, ignore_index=True)
+        df = df[['cancer_code', 'Hugo_Symbol', 'genie_mut_fraq', 'genie_mut_freq', 'genie_gene_sample_count', 'genie_total_sample_count']]
+        return self.frequency_results(codes, df, rollup)
+
+    # Returns the MutationMatrix of the release's in panel SNPs, building it on first use
+    # Streaming analyses build it from MAF blocks instead of mutations_df
+    def mutation_matrix(self):
+        if self.matrix is None:
+            with REPORT.measure("parse", "mutation_matrix") as record:
+                print("Building sample x gene mutation matrix...")
+                encoded = self.parser.encoded_samples
+                sample_codes = encoded['sample'].to_numpy()
+                mapped = np.flatnonzero(sample_codes >= 0)[::-1] # unmapped samples (code -1) get no row
+                sample_rows = np.full(len(self.parser.encoding['sample']), -1, dtype=np.int64)
+                sample_rows[sample_codes[mapped]] = mapped # first row of a sample id
 
-        all_samples = self.unique_samples_by_cancer_code(code, rollup)
-        all_mutations = self.mutations_in_panel(code, rollup)
-        unique_genes = all_mutations.Hugo_Symbol.unique().tolist()
+                if self.streaming:
+                    columns = ['Hugo_Symbol', 'Tumor_Sample_Barcode', 'Variant_Type']
+                    chunks = (self.parser.encode_mutations(chunk) for chunk in self.parser.iter_release_file(self.parser.mutations_path, columns))
+                else:
+                    chunks = [self.parser.encoded_mutations]
+                rows = []
+                genes = []
+                for chunk in chunks:
+                    snps = self.cohort_snps(chunk, encoded['sample'].to_numpy())
+                    rows.append(sample_rows[snps['sample'].to_numpy()])
+                    genes.append(snps['gene'].to_numpy())
 
-        for gene in unique_genes:
-            target_mutations = all_mutations.loc[all_mutations['Hugo_Symbol'] == gene]
-            selected_samples = target_mutations.Tumor_Sample_Barcode.unique().tolist()
-            target_fraq = len(selected_samples) / len(all_samples)
-            target_freq = target_fraq*100
-            mutation_frequency[gene] = [target_fraq, target_freq, len(selected_samples), len(all_samples)]
+                shape = (len(encoded), len(self.parser.encoding['gene']))
+                self.matrix = MutationMatrix.from_pairs(np.concatenate(rows), np.concatenate(genes), shape)
+                record["rows"] = self.matrix.nnz
+        return self.matrix
 
-        df = pd.DataFrame.from_dict(mutation_frequency, orient="index").reset_index()
-        df.columns = ['Hugo_Symbol', 'genie_mut_fraq', 'genie_mut_freq', 'genie_gene_sample_count', 'genie_total_sample_count']
+    # Returns a boolean mask over samples_df rows of the samples matching every given criterion
+    #   codes    oncotree codes, or rollup codes when rollup
+    #   centers  contributing centers, the CENTER part of GENIE-CENTER-... sample ids
+    #   samples  SAMPLE_IDs
+    # ex. cohort_rows(codes=['LUAD'], centers=['MSK'])
+    def cohort_rows(self, codes=None, rollup=False, centers=None, samples=None):
+        rows = np.ones(len(self.samples_df), dtype=bool)
+        if codes is not None:
+            target = 'ROLLUP_ONCOTREE_CODE' if rollup else 'ONCOTREE_CODE'
+            rows &= self.samples_df[target].isin(codes).to_numpy()
+        if centers is not None:
+            rows &= self.samples_df['SAMPLE_ID'].astype(str).str.split('-').str[1].isin(centers).to_numpy()
+        if samples is not None:
+            rows &= self.samples_df['SAMPLE_ID'].isin(samples).to_numpy()
+        return rows
+
+    # Returns a df of mutation frequencies for the samples_df rows selected by a boolean mask, see cohort_rows
+    # Same columns as mutation_frequency_by_cancer_code, genes without mutations in the cohort are left out
+    def cohort_frequencies(self, rows):
+        rows = rows & self.unique_sample_rows()
+        df = self.cohort_counts(rows)
+        samples = np.flatnonzero(rows)
+        single = np.zeros(len(samples), dtype=np.int64) # every selected row is in cohort 0
+        if self.panel_denominators:
+            covered = self.covered_sample_counts(single, self.parser.encoded_samples['sample'].to_numpy()[samples], 1)[0]
+            df['genie_covered_sample_count'] = covered[self.parser.encode('gene', df['Hugo_Symbol'])]
+            df['genie_mut_fraq'] = df.genie_gene_sample_count / df.genie_covered_sample_count
+            df['genie_mut_freq'] = df.genie_mut_fraq*100
+        if self.intervals.method:
+            df = self.with_intervals(df, np.zeros(len(df), dtype=np.int64), samples, single)
         return df
 
+    # Returns a df of per gene sample counts and frequencies over every cohort sample for the selected rows
+    # rows must select each sample id once, see unique_sample_rows
+    def cohort_counts(self, rows):
+        counts = self.mutation_matrix().column_sums(rows)
+        genes = np.flatnonzero(counts)
+        df = pd.DataFrame({
+            'Hugo_Symbol': self.parser.encoding['gene'][genes],
+            'genie_gene_sample_count': counts[genes],
+            'genie_total_sample_count': np.full(len(genes), rows.sum(), dtype=np.int64)
+        })
+        df['genie_mut_fraq'] = df.genie_gene_sample_count / df.genie_total_sample_count
+        df['genie_mut_freq'] = df.genie_mut_fraq*100
+        return df[['Hugo_Symbol', 'genie_mut_fraq', 'genie_mut_freq', 'genie_gene_sample_count', 'genie_total_sample_count']]
+
+    # Returns a boolean mask over samples_df rows, True on the first row of each sample id
+    # Cohorts count duplicate sample ids once, as the pandas path's distinct sample counts do
+    def unique_sample_rows(self):
+        sample_codes = self.parser.encoded_samples['sample'].to_numpy()
+        first = np.zeros(len(sample_codes), dtype=bool)
+        first[np.unique(sample_codes, return_index=True)[1]] = True
+        return first
+
+    # Returns the SqlBackend over this release, loading it on first use
+    def sql_backend(self):
+        if self.sql is None:
+            self.sql = SqlBackend(self.parser, self.backend)
+        return self.sql
+
+    # Returns the codes, rolled up when rollup, without duplicates
+    def resolve_codes(self, codes, rollup=False):
+        if rollup:
+            codes = [self.oncotree_rollup_code(code) for code in codes]
+        return list(dict.fromkeys(codes)) # drop duplicates, keep order
+
+    # Returns the resolved cancer codes and an int coded df of (sample, cancer_code) for their cohorts
+    def cancer_code_cohorts(self, codes, rollup=False):
+        codes = self.resolve_codes(codes, rollup)
+        target = 'rollup_code' if rollup else 'oncotree_code'
+
+        code_ids = self.parser.encoding['oncotree_code'].get_indexer(codes)
+        encoded = self.parser.encoded_samples
+        cohorts = encoded.loc[encoded[target].isin(code_ids[code_ids >= 0]), ['sample', target]]
+        cohorts = cohorts.drop_duplicates().rename(columns={target: 'cancer_code'})
+        return codes, cohorts
+
+    # Returns the in panel SNPs of an int coded mutations df limited to the given sample codes
+    def cohort_snps(self, encoded, samples):
+        in_cohort = np.zeros(len(self.parser.encoding['sample']) + 1, dtype=bool) # trailing slot for -1
+        in_cohort[samples[samples >= 0]] = True # unmapped samples (code -1) are never in the cohort
+        sample_codes = encoded['sample'].to_numpy()
+        gene_codes = encoded['gene'].to_numpy()
+        mask = encoded['snp'].to_numpy() & in_cohort[sample_codes] & self.in_panel_codes(sample_codes, gene_codes)
+        return encoded.loc[mask, ['gene', 'sample']]
+
+    # Returns a long df of mutation frequencies from int coded cohort samples and their SNPs
+    # Caches the per code slices
+    def frequency_table(self, codes, cohorts, snps, rollup=False):
+        totals = cohorts.groupby('cancer_code')['sample'].nunique().rename('genie_total_sample_count')
+        pairs = snps.merge(cohorts, on='sample').drop_duplicates(['cancer_code', 'gene', 'sample'])
+
+        df = pairs.groupby(['cancer_code', 'gene']).size()
+        df = df.rename('genie_gene_sample_count').reset_index()
+        df = df.join(totals, on='cancer_code')
+        df['cancer_code'] = self.parser.encoding['oncotree_code'][df.cancer_code.to_numpy()]
+        df['Hugo_Symbol'] = self.parser.encoding['gene'][df.gene.to_numpy()]
+        df['genie_mut_fraq'] = df.genie_gene_sample_count / df.genie_total_sample_count
+        df['genie_mut_freq'] = df.genie_mut_fraq*100
+        df = df[['cancer_code', 'Hugo_Symbol', 'genie_mut_fraq', 'genie_mut_freq', 'genie_gene_sample_count', 'genie_total_sample_count']]
+        return self.frequency_results(codes, df, rollup)
+
+    # Returns a long frequency df finished for this analysis' mode and caches its per code slices
+    # With panel_denominators adds genie_covered_sample_count and divides by it
+    def frequency_results(self, codes, df, rollup=False):
+        if self.panel_denominators:
+            df = self.with_covered_counts(df, rollup)
+        if self.intervals.method:
+            code_ids, key_cohorts = np.unique(self.parser.encode('oncotree_code', df['cancer_code']), return_inverse=True)
+            target = 'rollup_code' if rollup else 'oncotree_code'
+            cohort_codes = self.parser.encoded_samples[target].to_numpy()
+            members = np.flatnonzero(np.isin(cohort_codes, code_ids[code_ids >= 0]) & self.unique_sample_rows())
+            df = self.with_intervals(df, key_cohorts, members, np.searchsorted(code_ids, cohort_codes[members]))
+        self.cache_frequencies(codes, df, rollup)
+        return df
+
+    # Returns a frequency df with genie_mut_freq_lower and genie_mut_freq_upper, see FrequencyIntervals
+    # key_cohorts is the cohort index of each df row, members the samples_df rows of the cohorts and
+    # member_cohorts their cohort index. Intervals are of the df's fraq, over covered samples with panel_denominators
+    def with_intervals(self, df, key_cohorts, members, member_cohorts):
+        print(f"Calculating {self.intervals.method} intervals of GENIE mutation frequency for {len(df)} genes")
+        if self.intervals.method == 'bootstrap':
+            member_panels = None
+            if self.panel_denominators:
+                member_panels = self.sample_panel_codes(self.parser.encoded_samples['sample'].to_numpy()[members])
+            lower, upper = self.intervals.bootstrap(self.mutation_matrix(), members, member_cohorts, key_cohorts,
+                self.parser.encode('gene', df['Hugo_Symbol']), member_panels, self.parser.panel_coverage_matrix)
+        else:
+            totals = df.genie_covered_sample_count if self.panel_denominators else df.genie_total_sample_count
+            lower, upper = self.intervals.binomial(df.genie_gene_sample_count, totals)
+        df = df.copy()
+        df['genie_mut_freq_lower'] = lower*100
+        df['genie_mut_freq_upper'] = upper*100
+        return df
+
+    # Returns a long frequency df with genie_covered_sample_count, the cohort samples whose panel covers the gene,
+    # and genie_mut_fraq/genie_mut_freq over it
+    def with_covered_counts(self, df, rollup=False):
+        target = 'rollup_code' if rollup else 'oncotree_code'
+        code_ids, inverse = np.unique(self.parser.encode('oncotree_code', df['cancer_code']), return_inverse=True)
+        cohorts = self.parser.encoded_samples[['sample', target]].drop_duplicates()
+        cohorts = cohorts.loc[cohorts[target].isin(code_ids[code_ids >= 0])]
+        covered = self.covered_sample_counts(np.searchsorted(code_ids, cohorts[target].to_numpy()), cohorts['sample'].to_numpy(), len(code_ids))
+
+        df = df.copy()
+        df['genie_covered_sample_count'] = covered[inverse, self.parser.encode('gene', df['Hugo_Symbol'])]
+        df['genie_mut_fraq'] = df.genie_gene_sample_count / df.genie_covered_sample_count
+        df['genie_mut_freq'] = df.genie_mut_fraq*100
+        return df
+
+    # Returns an int64 cohort x gene array of the number of samples whose panel covers each gene
+    # cohorts and samples are int coded (cohort index, sample) pairs, distinct per cohort
+    #
+    # A sample's coverage row is its panel's row of the panel x gene coverage matrix, so a cohort's
+    # summed sample x gene coverage is its per panel sample counts times that matrix
+    def covered_sample_counts(self, cohorts, samples, cohort_count):
+        panels = self.sample_panel_codes(samples)
+        panel_count = len(self.parser.encoding['panel'])
+        keep = panels >= 0
+        cohort_panels = np.bincount(cohorts[keep]*panel_count + panels[keep], minlength=cohort_count*panel_count)
+        return cohort_panels.reshape(cohort_count, panel_count) @ self.parser.panel_coverage_matrix.astype(np.int64)
+
+    # Caches the per code slices of a long frequency df, codes without rows get an empty df
+    def cache_frequencies(self, codes, df, rollup=False):
+        for code, code_df in df.groupby('cancer_code'):
+            self.frequency_cache[rollup][code] = code_df.drop(columns='cancer_code').reset_index(drop=True)
+        for code in codes:
+            if code not in self.frequency_cache[rollup]:
+                self.frequency_cache[rollup][code] = df.iloc[0:0].drop(columns='cancer_code')
+
     def sample_count_by_cancer_type(self, rollup=False):
+        if self.backend in ("duckdb", "sqlite"):
+            return self.sql_backend().sample_count_by_cancer_type(rollup)
         if rollup:
             target = 'ROLLUP_ONCOTREE_CODE'
         else:
@@ -162,7 +484,8 @@ class GenieAnalysis:
                 counts[target_code] = 1
         df = pd.DataFrame.from_dict(counts, orient="index").reset_index()
         df.columns = ['oncotree_code', 'sample_count']
-        df.sort_values('sample_count', inplace=True, ascending=False)
-        return df
+        # Ties sorted by code so the order does not depend on the sort algorithm or the sample file order
+        df.sort_values(['sample_count', 'oncotree_code'], inplace=True, ascending=[False, True])
+        return df.reset_index(drop=True)
 
 
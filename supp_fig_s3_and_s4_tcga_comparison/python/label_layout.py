@@ -0,0 +1,127 @@
+import numpy as np
+from matplotlib.font_manager import FontProperties
+
+# Minimum number of labels filled from secondary targets, then from leftovers
+LABEL_MIN = 8
+AXIS_MIN = 3
+
+# Directions tried around a point, in order; the first is the old default (text to the right)
+DIRECTIONS = [(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1), (1, -1)]
+
+# Number of rings of candidate positions tried around each point
+RINGS = 10
+
+ARROW_PROPS = dict(arrowstyle="-", color='dimgray', lw=0.5)
+
+# Picks and places point labels on a scatter plot
+# Labels are placed greedily in priority order on a grid of label-sized cells, so each candidate position
+# is only checked against boxes in the cells it covers. Every label tries at most len(DIRECTIONS) * RINGS positions
+# and the result only depends on the input order, so plots are reproducible.
+class LabelLayout:
+    # radius is the scatter marker radius in pixels
+    def __init__(self, fig, ax, radius, rings=RINGS):
+        self.ax = ax
+        self.radius = radius
+        self.rings = rings
+        self.renderer = fig.canvas.get_renderer()
+        self.font = FontProperties()
+        self.boxes = []
+        self.grid = {}
+        # Grid cells are one line of text high
+        self.cell = max(self.text_size("Hg")[1], 1.0)
+
+    # Returns indices of points to label, highest priority first
+    # Primary targets are outliers, then at least LABEL_MIN + 1 labels are filled from secondary targets and
+    # at least AXIS_MIN + 1 from the leftovers hugging the axes; secondary targets and leftovers are taken in row order,
+    # as the original selection loops did
+    @classmethod
+    def select(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        delta = np.abs(y - x)
+
+        primary = ((x > 30) | (y > 30) | ((y > 20) & (x > 10)) | ((x > 20) & (y > 10)) | (delta > 25))
+        secondary = ((y >= 5) & (x >= 5)) | ((y >= 1) & (delta > 10)) | ((x >= 1) & (delta > 10))
+
+        selected = np.nonzero(primary)[0].tolist()
+        if len(selected) <= LABEL_MIN:
+            candidates = np.nonzero(secondary & ~primary)[0]
+            selected.extend(candidates[:LABEL_MIN + 1 - len(selected)].tolist())
+        if len(selected) <= AXIS_MIN:
+            candidates = np.nonzero(~secondary)[0]
+            selected.extend(candidates[:AXIS_MIN + 1 - len(selected)].tolist())
+        return selected
+
+    # Blocks the area under existing artists, ex. a legend or text box
+    def add_obstacles(self, artists):
+        for artist in artists:
+            extent = artist.get_window_extent(self.renderer)
+            self.add_box((extent.x0, extent.y0, extent.x1, extent.y1))
+
+    # Blocks the area under scatter points, given in data coordinates
+    def add_points(self, x, y):
+        points = self.ax.transData.transform(np.column_stack([x, y]))
+        for px, py in points:
+            self.add_box((px - self.radius, py - self.radius, px + self.radius, py + self.radius))
+
+    # Returns the width and height of a label in pixels
+    def text_size(self, label):
+        width, height, descent = self.renderer.get_text_width_height_descent(str(label), self.font, ismath=False)
+        return width, height
+
+    # Annotates points (data coordinates) with labels, in the given order
+    # Returns the annotation artists
+    def place(self, labels, x, y):
+        fontsize = self.font.get_size_in_points()
+        sizes = [self.text_size(label) for label in labels]
+        bounds = self.ax.bbox
+        points = self.ax.transData.transform(np.column_stack([x, y])) if len(labels) > 0 else []
+        to_data = self.ax.transData.inverted()
+        annotations = []
+        for label, (px, py), (width, height) in zip(labels, points, sizes):
+            box = self.find_box(px, py, width, height, bounds)
+            self.add_box(box)
+            center = to_data.transform(((box[0] + box[2]) / 2, (box[1] + box[3]) / 2))
+            annotations.append(self.ax.annotate(label, to_data.transform((px, py)), xytext=center,
+                ha='center', va='center', fontsize=fontsize, arrowprops=ARROW_PROPS))
+        return annotations
+
+    # Returns the first free label box around a point, or the first in-bounds one when every candidate overlaps
+    def find_box(self, px, py, width, height, bounds):
+        fallback = None
+        for ring in range(self.rings):
+            gap = self.radius + ring * height
+            for dx, dy in DIRECTIONS:
+                cx = px + dx * (gap + width / 2)
+                cy = py + dy * (gap + height / 2)
+                box = (cx - width / 2, cy - height / 2, cx + width / 2, cy + height / 2)
+                if box[0] < bounds.x0 or box[1] < bounds.y0 or box[2] > bounds.x1 or box[3] > bounds.y1:
+                    continue
+                if fallback is None:
+                    fallback = box
+                if not self.overlaps(box):
+                    return box
+        if fallback is None:
+            fallback = (px, py, px + width, py + height)
+        return fallback
+
+    # Returns True if a box overlaps any placed box
+    def overlaps(self, box):
+        for key in self.cells(box):
+            for other in self.grid.get(key, ()):
+                other = self.boxes[other]
+                if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                    return True
+        return False
+
+    # Index a box on every grid cell it covers
+    def add_box(self, box):
+        self.boxes.append(box)
+        for key in self.cells(box):
+            self.grid.setdefault(key, []).append(len(self.boxes) - 1)
+
+    # Returns the grid cells covered by a box
+    def cells(self, box):
+        x0, y0 = int(box[0] // self.cell), int(box[1] // self.cell)
+        x1, y1 = int(box[2] // self.cell), int(box[3] // self.cell)
+        return [(i, j) for i in range(x0, x1 + 1) for j in range(y0, y1 + 1)]
@@ -0,0 +1,43 @@
+import numpy as np
+
+# Boolean sample x gene matrix of in panel SNPs in CSR form, numpy only
+# Row i is samples_df row i, column j is gene code j of the shared encoding (see ReleaseParser.create_encoding)
+#   indptr   int64, row i's genes are indices[indptr[i]:indptr[i + 1]]
+#   indices  int32 gene codes, sorted and distinct within a row
+# Only presence is stored, so a cohort's per gene sample counts are a column sum over its rows
+class MutationMatrix:
+    def __init__(self, indptr, indices, genes):
+        self.indptr = indptr
+        self.indices = indices
+        self.shape = (len(indptr) - 1, genes)
+
+    # Returns a MutationMatrix from int coded (row, gene) pairs, duplicates are dropped
+    @classmethod
+    def from_pairs(cls, rows, genes, shape):
+        order = np.lexsort((genes, rows))
+        rows = rows[order]
+        genes = genes[order]
+        keep = np.ones(len(rows), dtype=bool)
+        keep[1:] = (rows[1:] != rows[:-1]) | (genes[1:] != genes[:-1])
+        rows = rows[keep]
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=shape[0]), out=indptr[1:])
+        return cls(indptr, genes[keep].astype(np.int32), shape[1])
+
+    @property
+    def nnz(self):
+        return len(self.indices)
+
+    # Returns the number of genes mutated in each row
+    def row_counts(self):
+        return np.diff(self.indptr)
+
+    # Returns an int64 array of the number of selected rows with each gene, indexed by gene code
+    # rows is a boolean mask over the rows
+    def column_sums(self, rows):
+        entries = np.repeat(rows, self.row_counts())
+        return np.bincount(self.indices[entries], minlength=self.shape[1]).astype(np.int64)
+
+    # Returns the gene codes of a row
+    def row(self, i):
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
@@ -0,0 +1,129 @@
+import re
+import csv
+import numpy as np
+import pandas as pd
+
+# Number of level_N columns in oncotree_cancer_codes.tsv
+ONCOTREE_LEVELS = 7
+
+# Trailing "(CODE)" of a node label, ex. "Breast Invasive Ductal Carcinoma (IDC)"
+CODE_PATTERN = re.compile(r"\(([^()]+)\)\s*$")
+
+# Precomputed index over the OncoTree hierarchy
+# Built once from oncotree_cancer_codes.tsv
+#
+# Nodes are numbered in depth-first order so the descendants of a node are a contiguous range
+# Ancestor-at-level and lowest-common-ancestor queries are array lookups over ONCOTREE_LEVELS columns
+class OncoTreeIndex:
+    def __init__(self, path):
+        self.path = path
+        parents = self.parse_tree(path)
+
+        # Depth first ordering, children sorted by code
+        children = {}
+        for code, parent in parents.items():
+            children.setdefault(parent, []).append(code)
+        order = []
+        stack = sorted(children.get(None, []), reverse=True)
+        while stack:
+            code = stack.pop()
+            order.append(code)
+            stack.extend(sorted(children.get(code, []), reverse=True))
+
+        self.codes = pd.Index(order)
+        ids = {code: i for i, code in enumerate(order)}
+        self.parent = np.array([ids.get(parents[code], -1) for code in order], dtype=np.int32)
+
+        # Parents precede children in depth first order
+        self.depth = np.ones(len(order), dtype=np.int32)
+        for i in range(len(order)):
+            if self.parent[i] >= 0:
+                self.depth[i] = self.depth[self.parent[i]] + 1
+
+        # ancestors[i, level] = id of node i's ancestor at level (1 = tissue), -1 below node i's depth
+        levels = max(ONCOTREE_LEVELS, int(self.depth.max(initial=0)))
+        self.ancestors = np.full((len(order), levels + 1), -1, dtype=np.int32)
+        for i in range(len(order)):
+            if self.parent[i] >= 0:
+                self.ancestors[i] = self.ancestors[self.parent[i]]
+            self.ancestors[i, self.depth[i]] = i
+
+        # Descendants of node i are ids (i, subtree_end[i])
+        self.subtree_end = np.arange(1, len(order) + 1, dtype=np.int32)
+        for i in reversed(range(len(order))):
+            parent = self.parent[i]
+            if parent >= 0:
+                self.subtree_end[parent] = max(self.subtree_end[parent], self.subtree_end[i])
+
+    # Returns a dict of code to parent code (None for tissues) parsed from the tsv
+    # level_1	level_2	level_3	level_4	level_5	level_6	level_7	metamaintype	metacolor	metanci	metaumls	history
+    def parse_tree(self, path):
+        print("Parsing oncotree hierarchy...")
+        parents = {}
+        with open(path) as f:
+            reader = csv.reader(f, delimiter='\t')
+            next(reader) # header
+            for row in reader:
+                path_codes = []
+                for cell in row[:ONCOTREE_LEVELS]:
+                    # Some rows separate levels with spaces instead of tabs
+                    for label in re.split(r"\s{2,}", cell.strip()):
+                        match = CODE_PATTERN.search(label)
+                        if match:
+                            path_codes.append(match.group(1).strip())
+                parent = None
+                for code in path_codes:
+                    parents.setdefault(code, parent)
+                    parent = code
+        return parents
+
+    # Returns node ids for an array of codes, -1 where the code is not in the tree
+    def ids(self, codes):
+        return self.codes.get_indexer(pd.Index(codes, dtype=object))
+
+    # Returns the level of a code, 1 for tissues, None when the code is not in the tree
+    def level(self, code):
+        i = self.ids([code])[0]
+        if i < 0:
+            return None
+        return int(self.depth[i])
+
+    # Returns the ancestor of a code at the given level
+    # Codes above the level are returned as is, codes not in the tree return None
+    def ancestor_at_level(self, code, level):
+        return self.rollup([code], level)[0]
+
+    # Returns the ancestors at the given level for an array of codes
+    # Single array lookup; codes above the level are returned as is, codes not in the tree are None
+    # Raises a ValueError for levels outside 1 to the tree depth
+    def rollup(self, codes, level):
+        levels = self.ancestors.shape[1] - 1
+        if not 1 <= level <= levels:
+            raise ValueError(f"OncoTree level {level} is outside 1 to {levels}")
+        ids = self.ids(codes)
+        known = ids >= 0
+        targets = np.full(len(ids), -1, dtype=np.int32)
+        targets[known] = self.ancestors[ids[known], level]
+        shallow = known & (targets < 0)
+        targets[shallow] = ids[shallow]
+
+        rollup = np.full(len(ids), None, dtype=object)
+        rollup[targets >= 0] = self.codes[targets[targets >= 0]]
+        return rollup
+
+    # Returns a list of codes below a code, not including the code itself
+    def descendants(self, code):
+        i = self.ids([code])[0]
+        if i < 0:
+            return []
+        return self.codes[i + 1:self.subtree_end[i]].tolist()
+
+    # Returns the lowest common ancestor of two codes, None if they share no ancestor
+    def lowest_common_ancestor(self, code_a, code_b):
+        a, b = self.ids([code_a, code_b])
+        if a < 0 or b < 0:
+            return None
+        shared = np.nonzero((self.ancestors[a] == self.ancestors[b]) & (self.ancestors[a] >= 0))[0]
+        if len(shared) == 0:
+            return None
+        return self.codes[self.ancestors[a, shared[-1]]]
@@ -0,0 +1,65 @@
+import os
+import copy
+import traceback
+import multiprocessing
+from dotenv import load_dotenv
+from plot import Plot
+from run_report import RunReport, REPORT
+
+# Renders a single plot spec, returns its run report records and its error, None when it rendered
+# Module level so worker processes can unpickle it
+def render_plot(spec):
+    name, args, cohort = spec
+    report = RunReport()
+    error = None
+    try:
+        with report.measure("plot", name, cohort):
+            getattr(Plot, name)(*args)
+    except Exception as e:
+        traceback.print_exc()
+        print(f"Error in rendering plot {name}...")
+        error = f"{name} ({cohort}): {e}"
+    return report.records, error
+
+# Collects plot specs and renders them in a process pool
+# A spec is the name of a Plot classmethod and its arguments, copied when queued since callers keep mutating their frames
+# Workers are spawned rather than forked so they never inherit open BigQuery client threads
+# Spawned workers re-import the main script, so a script rendering plots must run under if __name__ == '__main__':
+# Without the guard each worker re-runs the script, whose plots are then rendered in-process instead of spawning more workers
+class PlotQueue:
+    def __init__(self, processes=None):
+        load_dotenv('/app/.env')
+        if processes is None:
+            processes = int(os.getenv("PLOT_PROCESSES") or os.cpu_count() or 1)
+        self.processes = processes
+        self.specs = []
+
+    # Queue a call to Plot.<name>(*args)
+    # cohort labels the plot in the run report
+    def add(self, name, *args, cohort=None):
+        self.specs.append((name, copy.deepcopy(args), cohort))
+
+    # Render every queued plot and empty the queue
+    # Every plot is attempted, then a RuntimeError lists the plots that failed to render
+    def render(self):
+        specs, self.specs = self.specs, []
+        if len(specs) == 0:
+            return
+        processes = min(self.processes, len(specs))
+        if multiprocessing.current_process().name != 'MainProcess':
+            print("Rendering plots in-process, a worker re-ran the main script. Run it under if __name__ == '__main__':")
+            processes = 1
+        print(f"Rendering {len(specs)} plots with {processes} processes...")
+        if processes <= 1:
+            results = [render_plot(spec) for spec in specs]
+        else:
+            with multiprocessing.get_context('spawn').Pool(processes) as pool:
+                results = pool.map(render_plot, specs, chunksize=1)
+
+        errors = []
+        for records, error in results:
+            REPORT.extend(records)
+            if error is not None:
+                errors.append(error)
+        if len(errors) > 0:
+            raise RuntimeError(f"{len(errors)} of {len(specs)} plots failed to render: {'; '.join(errors)}")
@@ -0,0 +1,232 @@
+import os
+import re
+import json
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+# Panel whose genes make up the generated gene universe
+REFERENCE_PANEL_PATH = "/app/references/data_gene_panel_PHS-TRISEQ-V2.txt"
+
+# Contributing centers, each gets its own panels
+CENTERS = ['MSK', 'DFCI', 'VICC', 'UHN', 'GRCC', 'NKI', 'JHU', 'MDA', 'PHS', 'UCSF', 'CRUK', 'WAKE']
+
+VARIANT_TYPES = ['SNP', 'DNP', 'INS', 'DEL', 'ONP']
+VARIANT_TYPE_WEIGHTS = [0.80, 0.02, 0.07, 0.10, 0.01]
+VARIANT_CLASSIFICATIONS = ['Missense_Mutation', 'Nonsense_Mutation', 'Silent', 'Splice_Site', 'Frame_Shift_Del', 'Frame_Shift_Ins', 'In_Frame_Del', "5'Flank", 'Intron']
+VARIANT_CLASSIFICATION_WEIGHTS = [0.55, 0.08, 0.12, 0.04, 0.06, 0.03, 0.02, 0.05, 0.05]
+BASES = np.array(['A', 'C', 'G', 'T'])
+
+# Rows of MAF generated and written at a time
+WRITE_BLOCK_ROWS = 1000000
+
+# Writes a synthetic GENIE release to /app/releases/RELEASE_ID, in the layout ReleaseParser reads
+#   data_clinical_sample_VERSION.txt   samples with '#' headers, ONCOTREE_CODE and SEQ_ASSAY_ID
+#   data_clinical_patient_VERSION.txt  patients with '#' headers
+#   data_mutations_extended_VERSION.txt MAF with a '#version' header
+#   data_gene_panel_PANEL.txt          stable_id, description and gene_list
+#   genomic_information_VERSION.txt    exon and intron regions of each panel's genes, BED coordinates
+#
+# samples      number of samples, about 1.3 per patient
+# panels       number of gene panels, spread over the centers
+# density      mean mutations per sample, per sample counts are heavy tailed like real tumours
+# Oncotree codes come from CANCER_CODES_PATH and ONCOTREE_CODES_PATH, genes from the reference panel
+class ReleaseGenerator:
+    def __init__(self, release_id, release_version, samples=10000, panels=20, density=8.0, seed=0):
+        load_dotenv(dotenv_path='/app/.env', verbose=True)
+        self.release_id = release_id
+        self.release_version = release_version
+        self.samples = samples
+        self.panels = panels
+        self.density = density
+        self.rng = np.random.RandomState(seed)
+        self.release_dir = f"/app/releases/{self.release_id}"
+
+    # Write every file of the release
+    def generate(self):
+        print(f"Generating release {self.release_id} version {self.release_version} with {self.samples} samples, {self.panels} panels and {self.density} mutations per sample...")
+        Path(self.release_dir).mkdir(parents=True, exist_ok=True)
+        genes = self.gene_universe()
+        panels = self.write_panels(genes)
+        samples_df = self.write_samples(panels)
+        self.write_patients(samples_df)
+        self.write_mutations(samples_df, genes)
+        print(f"Done generating release {self.release_id}")
+        return self.release_dir
+
+    # Returns the genes of the reference panel, or made up symbols without it
+    def gene_universe(self):
+        try:
+            with open(REFERENCE_PANEL_PATH) as f:
+                for line in f:
+                    spl = line.split(":")
+                    if spl[0] == 'gene_list':
+                        return np.array(sorted(set(spl[1].strip().upper().split("\t"))))
+        except OSError as err:
+            print(f"Unable to read reference panel, using generated gene symbols...")
+            print(err)
+        return np.array([f"GENE{i}" for i in range(400)])
+
+    # Returns the oncotree codes to draw samples from
+    # Codes rolled up in cancer_codes.json plus other OncoTree codes, which are not compared but still parsed
+    def oncotree_codes(self):
+        codes = []
+        with open(os.getenv("CANCER_CODES_PATH")) as cc:
+            for target in json.load(cc)['oncotree_rollup']:
+                codes.extend(target['rollup_codes'])
+        try:
+            with open(os.getenv("ONCOTREE_CODES_PATH")) as f:
+                codes.extend(re.findall(r"\(([A-Z0-9_]+)\)", f.read()))
+        except (OSError, TypeError) as err:
+            print(f"Unable to read oncotree codes...")
+            print(err)
+        return np.array(list(dict.fromkeys(codes)))
+
+    # Write the gene panels and their genomic information, returns a dict of panel -> center
+    # Panel sizes range from hotspot panels to the full gene universe
+    def write_panels(self, genes):
+        panels = {}
+        panel_genes_by_panel = {}
+        for i in range(self.panels):
+            center = CENTERS[i % len(CENTERS)]
+            panel = f"{center}-PANEL{i}-V{1 + i // len(CENTERS)}"
+            size = self.rng.randint(min(50, len(genes)), len(genes) + 1)
+            panel_genes = self.rng.choice(genes, size, replace=False)
+            with open(f"{self.release_dir}/data_gene_panel_{panel}.txt", "w") as f:
+                f.write(f"stable_id: {panel}\n")
+                f.write(f"description: {panel}, Number of Genes - {size}\n")
+                f.write("gene_list:\t" + "\t".join(panel_genes) + "\n")
+            panels[panel] = center
+            panel_genes_by_panel[panel] = panel_genes
+        self.write_genomic_information(genes, panel_genes_by_panel)
+        return panels
+
+    # Write the regions each panel covers, every gene has the same exons on every panel
+    # Exons are 50-300 bases and may overlap their neighbours, each is followed by an intron region
+    def write_genomic_information(self, genes, panel_genes_by_panel):
+        exon_counts = self.rng.randint(5, 20, len(genes))
+        exon_genes = np.repeat(np.arange(len(genes)), exon_counts)
+        lengths = self.rng.randint(50, 300, len(exon_genes))
+        gaps = self.rng.randint(-40, 3000, len(exon_genes))
+        gene_starts = self.rng.randint(1, 200000000, len(genes))
+        offsets = np.cumsum(lengths + gaps) - (lengths + gaps)
+        offsets = offsets - np.repeat(offsets[np.cumsum(exon_counts) - exon_counts], exon_counts) # restart per gene
+        starts = gene_starts[exon_genes] + offsets
+        exons = pd.DataFrame({
+            'Chromosome': self.rng.randint(1, 23, len(genes))[exon_genes],
+            'Start_Position': starts,
+            'End_Position': starts + lengths,
+            'Hugo_Symbol': genes[exon_genes],
+            'Feature_Type': 'exon'
+        })
+        introns = exons.assign(Start_Position=exons.End_Position, End_Position=exons.End_Position + np.maximum(gaps, 1), Feature_Type='intron')
+        regions = pd.concat([exons, introns], ignore_index=True)
+
+        frames = []
+        for panel, panel_genes in panel_genes_by_panel.items():
+            frames.append(regions.loc[regions.Hugo_Symbol.isin(panel_genes)].assign(SEQ_ASSAY_ID=panel))
+        df = pd.concat(frames, ignore_index=True)
+        df['ID'] = df.Hugo_Symbol
+        df['includeInPanel'] = True
+        df['clinicalReported'] = np.nan
+        path = f"{self.release_dir}/genomic_information_{self.release_version}.txt"
+        df[['Chromosome', 'Start_Position', 'End_Position', 'Hugo_Symbol', 'ID', 'SEQ_ASSAY_ID', 'Feature_Type', 'includeInPanel', 'clinicalReported']].to_csv(path, sep='\t', index=False)
+        print(f"Wrote {len(df)} panel regions to {path}")
+
+    # Write the clinical sample file, returns its df
+    # Cancer types are Zipf distributed, a few types hold most samples as in GENIE
+    def write_samples(self, panels):
+        codes = self.oncotree_codes()
+        weights = 1.0 / np.arange(1, len(codes) + 1)
+        self.rng.shuffle(weights)
+        patient_ids = np.sort(self.rng.randint(0, max(1, int(self.samples / 1.3)), self.samples))
+        panel_ids = np.array(list(panels.keys()))
+        panel_choice = self.rng.randint(0, len(panel_ids), self.samples)
+        centers = np.array([panels[panel] for panel in panel_ids])[panel_choice]
+
+        samples_df = pd.DataFrame({
+            'PATIENT_ID': [f"GENIE-{center}-{patient}" for center, patient in zip(centers, patient_ids)],
+            'SAMPLE_ID': [f"GENIE-{center}-{patient}-{i}" for i, (center, patient) in enumerate(zip(centers, patient_ids))],
+            'AGE_AT_SEQ_REPORT': self.rng.randint(18, 90, self.samples),
+            'ONCOTREE_CODE': codes[self.rng.choice(len(codes), self.samples, p=weights/weights.sum())],
+            'SAMPLE_TYPE': self.rng.choice(['Primary', 'Metastasis'], self.samples, p=[0.6, 0.4]),
+            'SEQ_ASSAY_ID': panel_ids[panel_choice]
+        })
+        path = f"{self.release_dir}/data_clinical_sample_{self.release_version}.txt"
+        with open(path, "w") as f:
+            f.write("#Patient Identifier\tSample Identifier\tAge at Which Sequencing was Reported\tOncotree Code\tSample Type\tSequence Assay ID\n")
+            f.write("#Patient Identifier\tSample Identifier\tAge at Which Sequencing was Reported\tOncotree Code\tSample Type\tSequence Assay ID\n")
+            f.write("#STRING\tSTRING\tNUMBER\tSTRING\tSTRING\tSTRING\n")
+            f.write("#1\t1\t1\t1\t1\t1\n")
+            samples_df.to_csv(f, sep='\t', index=False)
+        print(f"Wrote {len(samples_df)} samples to {path}")
+        return samples_df
+
+    # Write the clinical patient file
+    def write_patients(self, samples_df):
+        patients = samples_df['PATIENT_ID'].unique()
+        patients_df = pd.DataFrame({
+            'PATIENT_ID': patients,
+            'SEX': self.rng.choice(['Male', 'Female'], len(patients)),
+            'PRIMARY_RACE': self.rng.choice(['White', 'Black', 'Asian', 'Other', 'Unknown'], len(patients)),
+            'CENTER': [patient.split('-')[1] for patient in patients]
+        })
+        path = f"{self.release_dir}/data_clinical_patient_{self.release_version}.txt"
+        with open(path, "w") as f:
+            f.write("#Patient Identifier\tSex\tPrimary Race\tCenter\n")
+            f.write("#Patient Identifier\tSex\tPrimary Race\tCenter\n")
+            f.write("#STRING\tSTRING\tSTRING\tSTRING\n")
+            f.write("#1\t1\t1\t1\n")
+            patients_df.to_csv(f, sep='\t', index=False)
+        print(f"Wrote {len(patients_df)} patients to {path}")
+
+    # Write the MAF, WRITE_BLOCK_ROWS rows at a time
+    # Mutations per sample are geometric around density, genes are Zipf distributed so drivers recur
+    # Genes are drawn from the whole universe, so some calls fall outside the sample's panel
+    def write_mutations(self, samples_df, genes):
+        counts = self.rng.geometric(1.0 / (1.0 + self.density), len(samples_df)) - 1
+        barcodes = np.repeat(samples_df['SAMPLE_ID'].to_numpy(), counts)
+        centers = np.repeat(samples_df['SAMPLE_ID'].str.split('-').str[1].to_numpy(), counts)
+        gene_weights = 1.0 / np.arange(1, len(genes) + 1)**0.8
+        self.rng.shuffle(gene_weights)
+        gene_weights = gene_weights / gene_weights.sum()
+
+        path = f"{self.release_dir}/data_mutations_extended_{self.release_version}.txt"
+        with open(path, "w") as f:
+            f.write("#version 2.4\n")
+            for start in range(0, max(1, len(barcodes)), WRITE_BLOCK_ROWS):
+                block = barcodes[start:start + WRITE_BLOCK_ROWS]
+                positions = self.rng.randint(1, 2000, len(block)).astype(str).astype(object)
+                n = len(block)
+                reference = BASES[self.rng.randint(0, 4, n)]
+                maf = pd.DataFrame({
+                    'Hugo_Symbol': genes[self.rng.choice(len(genes), n, p=gene_weights)],
+                    'Center': centers[start:start + WRITE_BLOCK_ROWS],
+                    'NCBI_Build': 'GRCh37',
+                    'Chromosome': self.rng.randint(1, 23, n),
+                    'Start_Position': self.rng.randint(1, 250000000, n),
+                    'Variant_Classification': self.rng.choice(VARIANT_CLASSIFICATIONS, n, p=VARIANT_CLASSIFICATION_WEIGHTS),
+                    'Variant_Type': self.rng.choice(VARIANT_TYPES, n, p=VARIANT_TYPE_WEIGHTS),
+                    'Reference_Allele': reference,
+                    'Tumor_Seq_Allele2': BASES[(np.searchsorted(BASES, reference) + self.rng.randint(1, 4, n)) % 4],
+                    'Tumor_Sample_Barcode': block,
+                    'HGVSp_Short': "p.X" + positions + "Y",
+                    't_depth': self.rng.randint(50, 1000, n),
+                    't_alt_count': self.rng.randint(5, 50, n)
+                })
+                maf.to_csv(f, sep='\t', index=False, header=start == 0)
+        print(f"Wrote {len(barcodes)} mutations to {path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic GENIE release to /app/releases")
+    parser.add_argument("release_id")
+    parser.add_argument("release_version")
+    parser.add_argument("--samples", type=int, default=10000)
+    parser.add_argument("--panels", type=int, default=20)
+    parser.add_argument("--density", type=float, default=8.0, help="mean mutations per sample")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    ReleaseGenerator(args.release_id, args.release_version, args.samples, args.panels, args.density, args.seed).generate()
@@ -2,16 +2,47 @@ import os
 import sys
 import json
 import glob
+import hashlib
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pyarrow import csv
 from dotenv import load_dotenv
+from oncotree_index import OncoTreeIndex
+from run_report import REPORT, count_rows
+
+# MAF columns used by the analysis and downstream figures
+MUTATION_COLUMNS = [
+    'Hugo_Symbol',
+    'Tumor_Sample_Barcode',
+    'Variant_Type',
+    'Variant_Classification',
+    'HGVSp_Short'
+]
+
+# Bytes of MAF read per block when streaming
+STREAM_BLOCK_SIZE = 64 << 20
+
+# Returns the hex MD5 of a file, read in blocks
+def file_md5(path, block_size=1 << 20):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
 
 # Parses txt files from consortium releases into usable data structures
+# Each artifact is parsed on first access and memoized
 class ReleaseParser:
-    def __init__(self, release_id=None, release_version=None):
+    def __init__(self, release_id=None, release_version=None, use_cache=True, engine="pyarrow", mutation_columns=MUTATION_COLUMNS, releases_dir=None):
         load_dotenv(dotenv_path='/app/.env', verbose=True)
+        self.releases_dir = releases_dir or os.getenv("RELEASES_DIR", "/app/releases")
         self.release_id = release_id #ex. synXXX
         self.release_version = release_version #ex. 10.2
-        self.release_root = f"/app/releases/{release_id}"
+        self.use_cache = use_cache # read/write parsed tables under release_dir/cache
+        self.engine = engine # 'pyarrow' (multithreaded) or 'pandas'
+        self.mutation_columns = mutation_columns # None reads every MAF column
+        self.release_root = f"{self.releases_dir}/{release_id}"
 
         if self.release_id == None:
             self.release_id = os.getenv("SYNAPSE_RELEASE_ID")
@@ -19,29 +50,111 @@ class ReleaseParser:
             self.release_version = os.getenv("SYNAPSE_RELEASE_VERSION")
 
         # filepaths
-        self.release_dir = f"/app/releases/{self.release_id}"
-        self.mutations_path = f"/app/releases/{self.release_id}/data_mutations_extended_{self.release_version}.txt"
-        self.samples_path = f"/app/releases/{self.release_id}/data_clinical_sample_{self.release_version}.txt"
-        self.patients_path = f"/app/releases/{self.release_id}/data_clinical_patient_{self.release_version}.txt"
+        self.release_dir = f"{self.releases_dir}/{self.release_id}"
+        self.mutations_path = f"{self.release_dir}/data_mutations_extended_{self.release_version}.txt"
+        self.samples_path = f"{self.release_dir}/data_clinical_sample_{self.release_version}.txt"
+        self.patients_path = f"{self.release_dir}/data_clinical_patient_{self.release_version}.txt"
+        self.cache_root = f"{self.release_dir}/cache"
 
-        self.parse_all()
+        # Memoized artifacts
+        # Key = artifact name
+        # Value = parsed df or dict
+        self.artifacts = {}
+        self.manifest_checked = False
 
     # Help function to parse all files into dfs
+    # Raises a ValueError when the release files do not match the manifest, see verify_manifest
     def parse_all(self):
-        self.parse_oncotree_codes()
-        self.parse_cancer_codes()
-        self.parse_mutations()
-        self.parse_patients()
-        self.parse_samples()
-        self.parse_panel_genes()
-        self.create_sample_panel_dict() # dependent on samples df
+        for name in ['cancer_codes', 'oncotree_codes', 'oncotree_index', 'patients_df', 'samples_df',
+                     'panel_genes', 'panel_coverage_df', 'sample_panels', 'encoding', 'encoded_samples',
+                     'encoded_mutations', 'sample_panel_codes', 'panel_coverage_matrix']:
+            getattr(self, name)
+
+    # Returns a memoized artifact, computing it with parse on first access
+    # cached artifacts are dfs also read from and written to the parquet cache
+    # Each artifact is recorded in the run report, including the artifacts it depends on
+    # The release is checked against its manifest before the first artifact is parsed, see verify_manifest
+    def lazy(self, name, parse, cached=False):
+        if name not in self.artifacts:
+            self.verify_manifest()
+            with REPORT.measure("parse", name) as record:
+                value = None
+                if cached and self.use_cache:
+                    value = self.load_cached(name)
+                record["cached"] = value is not None
+                if value is None:
+                    value = parse()
+                    if cached and self.use_cache:
+                        self.save_cached(name, value)
+                record["rows"] = count_rows(value)
+            self.artifacts[name] = value
+        return self.artifacts[name]
+
+    @property
+    def cancer_codes(self):
+        return self.lazy('cancer_codes', self.parse_cancer_codes)
+
+    @property
+    def oncotree_codes(self):
+        return self.lazy('oncotree_codes', self.parse_oncotree_codes)
+
+    @property
+    def oncotree_index(self):
+        return self.lazy('oncotree_index', self.parse_oncotree_index)
+
+    @property
+    def mutations_df(self):
+        return self.lazy('mutations_df', self.parse_mutations, cached=True)
+
+    @property
+    def samples_df(self):
+        return self.lazy('samples_df', self.parse_samples, cached=True) # dependent on oncotree codes
+
+    @property
+    def patients_df(self):
+        return self.lazy('patients_df', self.parse_patients, cached=True)
+
+    @property
+    def panel_coverage_df(self):
+        return self.lazy('panel_coverage_df', self.create_panel_coverage_df, cached=True)
+
+    @property
+    def panel_genes(self):
+        return self.lazy('panel_genes', self.create_panel_gene_dict) # dependent on panel coverage
+
+    @property
+    def sample_panels(self):
+        return self.lazy('sample_panels', self.create_sample_panel_dict) # dependent on samples df
+
+    @property
+    def encoding(self):
+        return self.lazy('encoding', self.create_encoding) # dependent on samples df and panel coverage
+
+    @property
+    def encoded_samples(self):
+        return self.lazy('encoded_samples', self.create_encoded_samples) # dependent on encoding
+
+    @property
+    def encoded_mutations(self):
+        return self.lazy('encoded_mutations', self.create_encoded_mutations, cached=True) # dependent on encoding
+
+    @property
+    def sample_panel_codes(self):
+        return self.lazy('sample_panel_codes', self.create_sample_panel_codes) # dependent on encoded samples
+
+    @property
+    def panel_coverage_matrix(self):
+        return self.lazy('panel_coverage_matrix', self.create_panel_coverage_matrix) # dependent on encoding
+
+    @property
+    def panel_coding_sizes(self):
+        return self.lazy('panel_coding_sizes', self.parse_panel_coding_sizes)
 
     # Returns a json object of cancer codes in TCGA and GENIE 
     def parse_cancer_codes(self):
         print("Parsing cancer codes...")
         with open(os.getenv("CANCER_CODES_PATH")) as cc:
-            self.cancer_codes = json.load(cc)
-            return self.cancer_codes
+            return json.load(cc)
 
     # Returns a dict of cancer codes
     # Key code
@@ -49,50 +162,109 @@ class ReleaseParser:
     # level_1	level_2	level_3	level_4	level_5	level_6	level_7	metamaintype	metacolor	metanci	metaumls	history
     def parse_oncotree_codes(self):
         print("Parsing oncotree codes...")
-        self.oncotree_codes = {}
-        with open(os.getenv("CANCER_CODES_PATH")) as cc:
-            targets = json.load(cc)['oncotree_rollup']
-            for target in targets:
-                genie_code = target['genie_cancer_code']
-                rollup_codes = target['rollup_codes']
-                for code in rollup_codes:
-                    self.oncotree_codes[code] = genie_code
-        return self.oncotree_codes
+        oncotree_codes = {}
+        for target in self.cancer_codes['oncotree_rollup']:
+            genie_code = target['genie_cancer_code']
+            rollup_codes = target['rollup_codes']
+            for code in rollup_codes:
+                oncotree_codes[code] = genie_code
+        return oncotree_codes
+
+    # Returns an index over the OncoTree hierarchy
+    def parse_oncotree_index(self):
+        return OncoTreeIndex(os.getenv("ONCOTREE_CODES_PATH"))
+
+    # Returns the oncotree code of every sample rolled up to an OncoTree level, aligned with samples_df
+    # 1 = tissue; codes above the level are kept, codes not in the tree are None
+    def oncotree_level_codes(self, level):
+        # Roll up each encoded code once, then one array lookup per sample
+        rollup = np.append(self.oncotree_index.rollup(self.encoding['oncotree_code'], level), None) # trailing slot for -1
+        return pd.Series(rollup[self.encoded_samples['oncotree_code'].to_numpy()], index=self.samples_df.index)
+
+    # Returns a df of a tab delimited release file
+    # Leading '#' header lines are skipped, matching read_csv(comment="#")
+    # columns limits the df to the given columns
+    # dictionary returns string columns as categoricals
+    def read_release_file(self, path, columns=None, dictionary=False):
+        if self.engine == "pandas":
+            usecols = None if columns is None else (lambda column: column in columns)
+            dtype = 'category' if dictionary else None
+            return pd.read_csv(path, sep='\t', comment="#", usecols=usecols, dtype=dtype)
+
+        read_options = csv.ReadOptions(use_threads=True, skip_rows=self.count_comment_lines(path))
+        parse_options = csv.ParseOptions(delimiter='\t')
+        convert_options = self.convert_options(columns, dictionary)
+        table = csv.read_csv(path, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+        return table.to_pandas()
+
+    # Yields dfs of a tab delimited release file, block_size bytes at a time
+    # Only one block is held in memory at once
+    def iter_release_file(self, path, columns=None, block_size=STREAM_BLOCK_SIZE):
+        self.verify_manifest()
+        if self.engine == "pandas":
+            usecols = None if columns is None else (lambda column: column in columns)
+            # MAF rows average around 1kB across all columns
+            chunksize = max(1, block_size // 1024)
+            for chunk in pd.read_csv(path, sep='\t', comment="#", usecols=usecols, chunksize=chunksize):
+                yield chunk
+            return
+
+        read_options = csv.ReadOptions(use_threads=True, skip_rows=self.count_comment_lines(path), block_size=block_size)
+        parse_options = csv.ParseOptions(delimiter='\t')
+        convert_options = self.convert_options(columns)
+        # Pin projected columns to strings so every block has the same schema
+        if columns is not None:
+            convert_options.column_types = {column: pa.string() for column in columns}
+        reader = csv.open_csv(path, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+        for batch in reader:
+            yield batch.to_pandas()
+
+    # Returns the number of leading '#' header lines in a release file
+    def count_comment_lines(self, path):
+        skip_rows = 0
+        with open(path) as f:
+            for line in f:
+                if not line.startswith("#"):
+                    break
+                skip_rows += 1
+        return skip_rows
+
+    # Returns pyarrow convert options for a column projection
+    def convert_options(self, columns=None, dictionary=False):
+        convert_options = csv.ConvertOptions(strings_can_be_null=True)
+        if columns is not None:
+            convert_options.include_columns = columns
+            convert_options.include_missing_columns = True
+            if dictionary:
+                convert_options.column_types = {column: pa.dictionary(pa.int32(), pa.string()) for column in columns}
+        elif dictionary:
+            convert_options.auto_dict_encode = True
+        return convert_options
 
     # Returns a df of mutations in the release
     def parse_mutations(self):
         print("Parsing mutations...")
-        self.mutations_df = pd.read_csv(self.mutations_path, sep='\t', comment="#")
-        return self.mutations_df
+        return self.read_release_file(self.mutations_path, self.mutation_columns, dictionary=True)
 
     # Returns a df of samples in the release
     def parse_samples(self):
         print("Parsing samples...")
-        self.samples_df = pd.read_csv(self.samples_path, sep='\t', comment="#")
-        rollup_codes = []
-        for i, row in self.samples_df.iterrows():
-            try:
-                oncotree_code = row['ONCOTREE_CODE']
-                rollup_code = self.oncotree_codes[oncotree_code]
-            except:
-                rollup_code = None
-
-            rollup_codes.append(rollup_code)
-        self.samples_df["ROLLUP_ONCOTREE_CODE"] = rollup_codes
-        return self.samples_df
+        samples_df = self.read_release_file(self.samples_path)
+        oncotree_codes = self.oncotree_codes
+        samples_df["ROLLUP_ONCOTREE_CODE"] = [oncotree_codes.get(code) for code in samples_df['ONCOTREE_CODE']]
+        return samples_df
 
     # Returns a df of patients in the release
     def parse_patients(self):
         print("Parsing patients...")
-        self.patients_df = pd.read_csv(self.patients_path, sep='\t', comment="#")
-        return self.patients_df
+        return self.read_release_file(self.patients_path)
     
-    # Returns a dictionary of gene panels
+    # Returns a dictionary of gene panels parsed from the panel files
     # Key = stable_id
     # Value = gene_list
     def parse_panel_genes(self):
         print("Parsing panel genes...")
-        self.panel_genes = {}
+        panel_genes = {}
         panel_files = glob.glob(f"{self.release_dir}/data_gene_panel*.txt")
         for panel_file in panel_files:
             with open(panel_file) as f:
@@ -107,30 +279,237 @@ class ReleaseParser:
                     if spl[0] == 'gene_list':
                         genes = spl[1].strip().upper().split("\t")
 
-                self.panel_genes[panel] = set(genes)
-        return self.panel_genes
+                panel_genes[panel] = set(genes)
+        return panel_genes
+
+    # Returns a long df of the genes covered by each panel
+    # One row per (SEQ_ASSAY_ID, Hugo_Symbol) pair
+    def create_panel_coverage_df(self):
+        print("Parsing panel coverage...")
+        rows = []
+        for panel, genes in self.parse_panel_genes().items():
+            for gene in sorted(genes):
+                rows.append([panel, gene])
+        return pd.DataFrame(rows, columns=['SEQ_ASSAY_ID', 'Hugo_Symbol'])
+
+    # Returns a dictionary of gene panels from the panel coverage df
+    # Key = stable_id
+    # Value = gene_list
+    def create_panel_gene_dict(self):
+        panel_genes = {}
+        for panel, genes in self.panel_coverage_df.groupby('SEQ_ASSAY_ID').Hugo_Symbol:
+            panel_genes[panel] = set(genes)
+        return panel_genes
 
     # Returns a dict of samples and their associated panels
     # Key = SAMPLE_ID
     # Value = SEQ_ASSAY_ID
     def create_sample_panel_dict(self):
         print("Parsing sample panels...")
-        self.sample_panels = {}
-        for i, row in self.samples_df.iterrows():
-            self.sample_panels[row['SAMPLE_ID']] = row['SEQ_ASSAY_ID']
-        return self.sample_panels
-
-    def save_parsed_dataframes(self):
-        print("Saving parsed dataframes and dicts to file...")
-        df_list = [
-            ["mutations_df", self.mutations_df],
-            ["samples_df", self.samples_df],
-            ["patients_df", self.patients_df]
-        ]
-    
-        os.makedirs(f"/app/outputs/{self.release_version}", exist_ok=True)
-        
-        for arr in df_list:
-            name = arr[0]
-            df = arr[1]
-            df.to_csv(f"/app/outputs/{self.release_version}/{name}.tsv", sep='\t', index=False)
+        return dict(zip(self.samples_df['SAMPLE_ID'], self.samples_df['SEQ_ASSAY_ID']))
+
+    # Returns a dict of shared integer encodings for release identifiers
+    # Key = 'sample', 'patient', 'gene', 'panel' or 'oncotree_code'
+    # Value = sorted pd.Index, a value's code is its position
+    #
+    # Genes are the panel genes; genes outside every panel are never counted and encode as -1
+    def create_encoding(self):
+        print("Encoding release identifiers...")
+        samples_df = self.samples_df
+        coverage = self.panel_coverage_df
+        oncotree_codes = self.oncotree_codes
+        values = {
+            'sample': samples_df['SAMPLE_ID'],
+            'patient': samples_df['PATIENT_ID'],
+            'gene': coverage['Hugo_Symbol'],
+            'panel': pd.concat([samples_df['SEQ_ASSAY_ID'].astype(object), coverage['SEQ_ASSAY_ID'].astype(object)]),
+            'oncotree_code': pd.concat([
+                samples_df['ONCOTREE_CODE'].astype(object),
+                samples_df['ROLLUP_ONCOTREE_CODE'].astype(object),
+                pd.Series(list(oncotree_codes.keys()) + list(oncotree_codes.values()), dtype=object)
+            ])
+        }
+        encoding = {}
+        for name, column in values.items():
+            encoding[name] = pd.Index(sorted(set(value for value in column if isinstance(value, str))))
+        return encoding
+
+    # Returns int32 codes of values in the shared encoding, -1 where unknown
+    def encode(self, name, values):
+        index = self.encoding[name]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Encode the categories once, code -1 (missing) picks the trailing -1
+            codes = np.append(index.get_indexer(values.cat.categories), -1)
+            return codes[values.cat.codes.to_numpy()].astype(np.int32)
+        return index.get_indexer(values).astype(np.int32)
+
+    # Returns an int coded df of a mutations df
+    # gene and sample are shared encoding codes, snp flags Variant_Type == 'SNP'
+    def encode_mutations(self, mutations):
+        return pd.DataFrame({
+            'gene': self.encode('gene', mutations['Hugo_Symbol']),
+            'sample': self.encode('sample', mutations['Tumor_Sample_Barcode']),
+            'snp': (mutations['Variant_Type'] == 'SNP').to_numpy(dtype=bool)
+        }, index=mutations.index)
+
+    # Returns an int coded df of the mutations in the release
+    # Encodes mutations_df when it is already parsed, otherwise the MAF is encoded block by block
+    # straight from the reader so the string MAF is never held in memory
+    def create_encoded_mutations(self):
+        if 'mutations_df' in self.artifacts:
+            return self.encode_mutations(self.mutations_df).reset_index(drop=True)
+        print("Encoding mutations...")
+        columns = ['Hugo_Symbol', 'Tumor_Sample_Barcode', 'Variant_Type']
+        blocks = [self.encode_mutations(pd.DataFrame({column: pd.Series([], dtype=object) for column in columns}))]
+        for chunk in self.iter_release_file(self.mutations_path, columns):
+            blocks.append(self.encode_mutations(chunk))
+        return pd.concat(blocks, ignore_index=True)
+
+    # Returns an int coded df of the samples in the release, row aligned with samples_df
+    def create_encoded_samples(self):
+        samples_df = self.samples_df
+        return pd.DataFrame({
+            'sample': self.encode('sample', samples_df['SAMPLE_ID']),
+            'patient': self.encode('patient', samples_df['PATIENT_ID']),
+            'oncotree_code': self.encode('oncotree_code', samples_df['ONCOTREE_CODE']),
+            'rollup_code': self.encode('oncotree_code', samples_df['ROLLUP_ONCOTREE_CODE']),
+            'panel': self.encode('panel', samples_df['SEQ_ASSAY_ID'])
+        }, index=samples_df.index)
+
+    # Returns an int32 array of panel codes indexed by sample code
+    def create_sample_panel_codes(self):
+        encoded = self.encoded_samples
+        sample_panel_codes = np.full(len(self.encoding['sample']), -1, dtype=np.int32)
+        mapped = encoded['sample'].to_numpy() >= 0 # unmapped samples (code -1) would index the last sample
+        sample_panel_codes[encoded['sample'].to_numpy()[mapped]] = encoded['panel'].to_numpy()[mapped]
+        return sample_panel_codes
+
+    # Returns a boolean panel x gene array, True where the panel covers the gene
+    def create_panel_coverage_matrix(self):
+        coverage = self.panel_coverage_df
+        matrix = np.zeros((len(self.encoding['panel']), len(self.encoding['gene'])), dtype=bool)
+        matrix[self.encode('panel', coverage['SEQ_ASSAY_ID']), self.encode('gene', coverage['Hugo_Symbol'])] = True
+        return matrix
+
+    # Returns a df of SEQ_ASSAY_ID, coding_mb, the megabases of coding sequence each panel covers
+    # Read from TMB_PANEL_SIZES_PATH when set, a TSV of those two columns, otherwise computed from the
+    # release's genomic information (genomic_information*.txt or genie_combined.bed): the union of each
+    # panel's exon regions that are included in the panel, BED coordinates
+    def parse_panel_coding_sizes(self):
+        print("Parsing panel coding sizes...")
+        sizes_path = os.getenv("TMB_PANEL_SIZES_PATH")
+        if sizes_path:
+            return pd.read_csv(sizes_path, sep='\t', comment="#")[['SEQ_ASSAY_ID', 'coding_mb']]
+
+        paths = sorted(glob.glob(f"{self.release_dir}/genomic_information*.txt")) + sorted(glob.glob(f"{self.release_dir}/genie_combined.bed"))
+        if len(paths) == 0:
+            print(f"No genomic information in {self.release_dir}, panel coding sizes are unknown")
+            return pd.DataFrame({'SEQ_ASSAY_ID': pd.Series([], dtype=object), 'coding_mb': pd.Series([], dtype=float)})
+        regions = self.read_release_file(paths[0])
+        if 'Feature_Type' in regions.columns:
+            regions = regions.loc[regions['Feature_Type'].astype(str).str.lower() == 'exon']
+        if 'includeInPanel' in regions.columns:
+            regions = regions.loc[regions['includeInPanel'].astype(str).str.lower() != 'false']
+
+        # Each region adds the bases past the furthest end of the earlier regions on its panel and chromosome
+        regions = pd.DataFrame({
+            'SEQ_ASSAY_ID': regions['SEQ_ASSAY_ID'].astype(str).str.upper().to_numpy(),
+            'Chromosome': regions['Chromosome'].astype(str).to_numpy(),
+            'start': regions['Start_Position'].to_numpy(dtype=np.int64),
+            'end': regions['End_Position'].to_numpy(dtype=np.int64)
+        }).sort_values(['SEQ_ASSAY_ID', 'Chromosome', 'start', 'end'])
+        furthest = regions.groupby(['SEQ_ASSAY_ID', 'Chromosome'])['end'].cummax()
+        previous = furthest.groupby([regions['SEQ_ASSAY_ID'], regions['Chromosome']]).shift(1).fillna(-1).to_numpy(dtype=np.int64)
+        regions['bases'] = np.maximum(regions['end'].to_numpy() - np.maximum(regions['start'].to_numpy(), previous), 0)
+        sizes = regions.groupby('SEQ_ASSAY_ID')['bases'].sum() / 1e6
+        return sizes.rename('coding_mb').reset_index()
+
+    # Returns a list of problems with the release files, checked against the manifest written by SynapseGateway.fetch_release_files
+    # Sizes are always compared, md5 also re-hashes every file
+    # Releases fetched without a manifest are not checked
+    def check_manifest(self, md5=False):
+        try:
+            with open(f"{self.release_dir}/manifest.json") as f:
+                manifest = json.load(f)
+        except OSError:
+            return []
+
+        problems = []
+        for name, entry in sorted(manifest["files"].items()):
+            path = f"{self.release_dir}/{name}"
+            if not entry.get("verified"):
+                problems.append(f"{name} was not verified when fetched")
+            elif not os.path.isfile(path):
+                problems.append(f"{name} is missing")
+            elif os.path.getsize(path) != entry["size"]:
+                problems.append(f"{name} is {os.path.getsize(path)} bytes, expected {entry['size']}")
+            elif md5 and file_md5(path) != entry["md5"]:
+                problems.append(f"{name} does not match its MD5")
+        for problem in problems:
+            print(f"Release {self.release_id} manifest check: {problem}")
+        return problems
+
+    # Raises a ValueError when check_manifest finds problems with the release files
+    # Runs once per parser, the first time any release file or artifact is read
+    def verify_manifest(self):
+        if self.manifest_checked:
+            return
+        problems = self.check_manifest()
+        if len(problems) > 0:
+            raise ValueError(f"Release {self.release_id} does not match its manifest, re-run SynapseGateway.fetch_release_files: {'; '.join(problems)}")
+        self.manifest_checked = True
+
+    # Returns a dict describing the release source files
+    # Keyed by release id, version and each file's size and mtime
+    def source_fingerprint(self):
+        sources = [self.mutations_path, self.samples_path, self.patients_path, str(os.getenv("CANCER_CODES_PATH"))]
+        sources.extend(sorted(glob.glob(f"{self.release_dir}/data_gene_panel*.txt")))
+        files = {}
+        for source in sources:
+            stat = os.stat(source)
+            files[os.path.basename(source)] = [stat.st_size, stat.st_mtime_ns]
+        return {
+            "release_id": self.release_id,
+            "release_version": self.release_version,
+            "engine": self.engine,
+            "mutation_columns": self.mutation_columns,
+            "files": files
+        }
+
+    # Returns the cache directory for the current source files
+    def cache_dir(self):
+        if 'cache_dir' not in self.artifacts:
+            fingerprint = json.dumps(self.source_fingerprint(), sort_keys=True)
+            key = hashlib.md5(fingerprint.encode()).hexdigest()
+            self.artifacts['cache_dir'] = f"{self.cache_root}/{self.release_version}_{key}"
+        return self.artifacts['cache_dir']
+
+    # Writes a parsed df to the parquet cache under the release directory
+    def save_cached(self, name, df):
+        print(f"Saving {name} to cache...")
+        try:
+            cache_dir = self.cache_dir()
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(f"{cache_dir}/fingerprint.json", "w") as f:
+                json.dump(self.source_fingerprint(), f, indent=4, sort_keys=True)
+            # Write then rename so a crash never leaves a partial table behind
+            df.to_parquet(f"{cache_dir}/{name}.parquet.tmp", index=False)
+            os.replace(f"{cache_dir}/{name}.parquet.tmp", f"{cache_dir}/{name}.parquet")
+        except Exception as err:
+            print(f"Unable to save {name} to cache...")
+            print(err)
+
+    # Returns a parsed df from the parquet cache
+    # Returns None when no cache matches the current source files
+    def load_cached(self, name):
+        try:
+            path = f"{self.cache_dir()}/{name}.parquet"
+        except OSError as err:
+            print("Unable to fingerprint release files...")
+            print(err)
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        print(f"Loading {name} from cache: {path}")
+        return pd.read_parquet(path)
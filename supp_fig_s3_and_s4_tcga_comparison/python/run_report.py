@@ -0,0 +1,110 @@
+import os
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+import pandas as pd
+
+# Returns the peak resident set size of this process in MB
+def peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+# Returns the number of rows of a df, the summed rows of a dict of dfs, None for anything else
+def count_rows(value):
+    if isinstance(value, pd.DataFrame):
+        return len(value)
+    if isinstance(value, dict) and len(value) > 0 and all(isinstance(df, pd.DataFrame) for df in value.values()):
+        return sum(len(df) for df in value.values())
+    return None
+
+# Collects timing and memory records of a run and writes them as a JSON report
+#
+# A record is one measured piece of work
+#   kind             ex. stage, parse, frequencies, query, merge, plot
+#   name             ex. the stage, artifact or Plot method name
+#   cohort           cancer code when the work is for a single cohort
+#   wall_seconds     elapsed time
+#   cpu_seconds      process CPU time, work on other threads (ex. prefetched queries) overlaps
+#   peak_rss_mb      the process peak RSS when the work finished, plots rendered in pool workers report their worker's
+#   rows             rows produced, when known
+#   bytes_processed  BigQuery bytes billed for queries, 0 when served from the cache
+# Work that raises is recorded with its error
+#
+# Records are appended from threads, REPORT is the instance shared across modules
+class RunReport:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = []
+        self.started = time.time()
+        self.cpu_started = time.process_time()
+
+    # Measure the work in the with block
+    # Yields the record, so the work can add fields such as rows
+    @contextmanager
+    def measure(self, kind, name, cohort=None):
+        record = {"kind": kind, "name": name, "cohort": cohort}
+        wall = time.time()
+        cpu = time.process_time()
+        try:
+            yield record
+        except Exception as err:
+            record["error"] = str(err)
+            raise
+        finally:
+            record["wall_seconds"] = round(time.time() - wall, 4)
+            record["cpu_seconds"] = round(time.process_time() - cpu, 4)
+            record["peak_rss_mb"] = peak_rss_mb()
+            self.add(record)
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def extend(self, records):
+        with self.lock:
+            self.records.extend(records)
+
+    # Drop the records and restart the clocks
+    def reset(self):
+        with self.lock:
+            self.records = []
+            self.started = time.time()
+            self.cpu_started = time.process_time()
+
+    # Returns the report, run totals and per kind totals followed by every record
+    def summary(self, release_id=None, release_version=None):
+        with self.lock:
+            records = list(self.records)
+        kinds = {}
+        for record in records:
+            totals = kinds.setdefault(record["kind"], {"count": 0, "wall_seconds": 0.0, "rows": 0})
+            totals["count"] += 1
+            totals["wall_seconds"] = round(totals["wall_seconds"] + record.get("wall_seconds", 0), 4)
+            totals["rows"] += record.get("rows") or 0
+        return {
+            "release_id": release_id,
+            "release_version": release_version,
+            "started": self.started,
+            "wall_seconds": round(time.time() - self.started, 4),
+            "cpu_seconds": round(time.process_time() - self.cpu_started, 4),
+            "peak_rss_mb": peak_rss_mb(),
+            "bytes_processed": sum(record.get("bytes_processed") or 0 for record in records),
+            "errors": sum(1 for record in records if "error" in record),
+            "kinds": kinds,
+            "records": records
+        }
+
+    # Write the report to path as JSON
+    def write(self, path, release_id=None, release_version=None):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(self.summary(release_id, release_version), f, indent=4, default=str)
+            os.replace(f"{path}.tmp", path)
+            print(f"Wrote run report to {path}")
+        except Exception as err:
+            print(f"Unable to write run report to {path}...")
+            print(err)
+
+REPORT = RunReport()
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import pandas as pd
+
+# DuckDB is optional, SQLite from the standard library is used without it
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# The GENIE query over a release, see "Original GENIE Query" in genie_analysis.py
+# In panel SNPs of each cohort counted per (cancer code, gene), with the cohort's sample total
+# {code_column} is ONCOTREE_CODE or ROLLUP_ONCOTREE_CODE, {codes} a placeholder per code
+FREQUENCY_QUERY = """
+WITH cohort AS (
+    SELECT DISTINCT {code_column} AS cancer_code, SAMPLE_ID, SEQ_ASSAY_ID
+      FROM samples
+     WHERE {code_column} IN ({codes})
+), totals AS (
+    SELECT cancer_code, COUNT(DISTINCT SAMPLE_ID) AS genie_total_sample_count
+      FROM cohort
+  GROUP BY cancer_code
+), counts AS (
+    SELECT cohort.cancer_code, m.Hugo_Symbol, COUNT(DISTINCT cohort.SAMPLE_ID) AS genie_gene_sample_count
+      FROM mutations m
+      JOIN cohort ON m.Tumor_Sample_Barcode = cohort.SAMPLE_ID
+      JOIN panel_genes p ON p.SEQ_ASSAY_ID = cohort.SEQ_ASSAY_ID AND p.Hugo_Symbol = m.Hugo_Symbol
+     WHERE m.Variant_Type = 'SNP'
+  GROUP BY cohort.cancer_code, m.Hugo_Symbol
+)
+SELECT counts.cancer_code, counts.Hugo_Symbol, counts.genie_gene_sample_count, totals.genie_total_sample_count
+  FROM counts JOIN totals ON counts.cancer_code = totals.cancer_code
+"""
+
+# Samples per upper cased oncotree code, missing codes are labelled as the pandas loop does (NAN)
+# Sorted by count, ties by code, the same order as GenieAnalysis.sample_count_by_cancer_type
+SAMPLE_COUNT_QUERY = """
+SELECT UPPER({code_column}) AS oncotree_code, COUNT(*) AS sample_count
+  FROM samples
+GROUP BY UPPER({code_column})
+ORDER BY sample_count DESC, oncotree_code
+"""
+
+# Runs the GENIE analysis as SQL over a release's parsed tables
+# DuckDB scans the parsed frames in place with one thread per CPU, SQLite copies them into an in memory database
+#   samples      SAMPLE_ID, ONCOTREE_CODE, ROLLUP_ONCOTREE_CODE, SEQ_ASSAY_ID
+#   mutations    Hugo_Symbol, Tumor_Sample_Barcode, Variant_Type
+#   panel_genes  SEQ_ASSAY_ID, Hugo_Symbol
+class SqlBackend:
+    def __init__(self, parser, engine=None):
+        self.parser = parser
+        self.engine = engine or ("duckdb" if duckdb is not None else "sqlite")
+        self.connection = None
+
+    # Returns a connection with the release tables loaded
+    def connect(self):
+        if self.connection is None:
+            print(f"Loading release {self.parser.release_id} into {self.engine}...")
+            tables = self.tables()
+            if self.engine == "duckdb":
+                if duckdb is None:
+                    raise ImportError("duckdb is not installed, use the sqlite engine")
+                connection = duckdb.connect()
+                connection.execute(f"PRAGMA threads={os.cpu_count() or 1}")
+                for name, df in tables.items():
+                    connection.register(name, df)
+            else:
+                connection = sqlite3.connect(":memory:", check_same_thread=False)
+                for name, df in tables.items():
+                    df.to_sql(name, connection, index=False)
+                connection.execute("CREATE INDEX samples_code ON samples (ONCOTREE_CODE)")
+                connection.execute("CREATE INDEX samples_rollup_code ON samples (ROLLUP_ONCOTREE_CODE)")
+                connection.execute("CREATE INDEX samples_id ON samples (SAMPLE_ID)")
+                connection.execute("CREATE INDEX mutations_sample ON mutations (Tumor_Sample_Barcode)")
+                connection.execute("CREATE INDEX panel_genes_panel ON panel_genes (SEQ_ASSAY_ID, Hugo_Symbol)")
+            self.connection = connection
+        return self.connection
+
+    # Returns the release tables as plain string columns
+    # Missing cancer codes become their string (ex. nan), so they are counted like GenieAnalysis.sample_count_by_cancer_type
+    def tables(self):
+        samples = self.parser.samples_df[['SAMPLE_ID', 'ONCOTREE_CODE', 'ROLLUP_ONCOTREE_CODE', 'SEQ_ASSAY_ID']].astype(object)
+        samples = samples.where(samples.notna(), None)
+        for column in ['ONCOTREE_CODE', 'ROLLUP_ONCOTREE_CODE']:
+            samples[column] = [code if pd.notna(code) else str(code) for code in self.parser.samples_df[column]]
+        mutations = self.parser.mutations_df[['Hugo_Symbol', 'Tumor_Sample_Barcode', 'Variant_Type']].astype(object)
+        return {
+            'samples': samples,
+            'mutations': mutations.where(mutations.notna(), None),
+            'panel_genes': self.parser.panel_coverage_df[['SEQ_ASSAY_ID', 'Hugo_Symbol']].astype(object)
+        }
+
+    # Returns a df of the query's results
+    def query(self, sql, params=()):
+        connection = self.connect()
+        if self.engine == "duckdb":
+            return connection.execute(sql, list(params)).fetchdf()
+        return pd.read_sql_query(sql, connection, params=list(params))
+
+    # Returns cancer_code, Hugo_Symbol, genie_gene_sample_count, genie_total_sample_count for the resolved codes
+    def mutation_counts(self, codes, rollup=False):
+        code_column = 'ROLLUP_ONCOTREE_CODE' if rollup else 'ONCOTREE_CODE'
+        if len(codes) == 0:
+            return pd.DataFrame(columns=['cancer_code', 'Hugo_Symbol', 'genie_gene_sample_count', 'genie_total_sample_count'])
+        sql = FREQUENCY_QUERY.format(code_column=code_column, codes=", ".join(["?"]*len(codes)))
+        return self.query(sql, codes)
+
+    # Returns oncotree_code, sample_count sorted by count then code, see GenieAnalysis.sample_count_by_cancer_type
+    def sample_count_by_cancer_type(self, rollup=False):
+        code_column = 'ROLLUP_ONCOTREE_CODE' if rollup else 'ONCOTREE_CODE'
+        return self.query(SAMPLE_COUNT_QUERY.format(code_column=code_column))
@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import hashlib
+import pandas as pd
+from run_report import REPORT, count_rows
+
+# A step of a pipeline
+# run is called with the values of the input stages and returns a df, a dict of dfs or None
+# params is anything json serializable describing the stage's own inputs, ex. source file fingerprints
+class Stage:
+    def __init__(self, name, run, inputs=[], params=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.params = params
+
+# Runs pipeline stages with per-stage checkpoints
+#
+# A stage's fingerprint hashes its name, params and the fingerprints of its inputs, so any upstream change
+# invalidates everything downstream of it. After a stage runs its value is checkpointed under checkpoint_dir:
+#   df          {name}.parquet
+#   dict of dfs {name}.{key}.parquet
+#   None        {name}.json only, for stages run for their side effects (ex. plots)
+# Stages whose checkpoint matches their fingerprint are skipped, and their value is only read back
+# when a stage that runs needs it.
+#
+# Stages are selected by their full name, or by any "_" separated part of it
+# ex. "plots" selects plots_rollup and plots_direct, "rollup" selects every stage of the rollup pass
+class StageGraph:
+    def __init__(self, checkpoint_dir):
+        self.checkpoint_dir = checkpoint_dir
+        self.stages = []
+        self.by_name = {}
+        self.values = {}
+        self.fingerprints = {}
+
+    def add(self, name, run, inputs=[], params=None):
+        for input_name in inputs:
+            if input_name not in self.by_name:
+                raise ValueError(f"Stage {name} depends on unknown stage {input_name}")
+        stage = Stage(name, run, inputs, params)
+        self.stages.append(stage)
+        self.by_name[name] = stage
+        return stage
+
+    # Returns the names of the stages matching any selector, in pipeline order
+    def select(self, selectors):
+        names = []
+        for stage in self.stages:
+            parts = stage.name.split('_')
+            if any(selector == stage.name or selector in parts for selector in selectors):
+                names.append(stage.name)
+        if len(names) == 0:
+            raise ValueError(f"No stages match {selectors}, stages are {[stage.name for stage in self.stages]}")
+        return names
+
+    # Run the pipeline
+    # start   re-run the first stage matching start and every stage after it
+    # only    re-run just the stages matching these selectors, their inputs come from checkpoints
+    # Without either, stages with an up to date checkpoint are skipped
+    def run(self, start=None, only=None):
+        names = [stage.name for stage in self.stages]
+        forced = set()
+        if start is not None:
+            first = names.index(self.select([start])[0])
+            forced = set(names[first:])
+        if only is not None:
+            forced = set(self.select(only))
+            names = [name for name in names if name in forced]
+
+        for name in names:
+            self.execute(name, force=name in forced)
+
+    # Runs a stage unless its checkpoint is up to date
+    def execute(self, name, force=False):
+        stage = self.by_name[name]
+        fingerprint = self.fingerprint(name)
+        if name in self.values and not force:
+            return
+        if not force and self.checkpoint_fingerprint(name) == fingerprint:
+            print(f"Skipping stage {name}, checkpoint is up to date")
+            REPORT.add({"kind": "stage", "name": name, "cohort": None, "skipped": True})
+            return
+
+        inputs = [self.value(input_name) for input_name in stage.inputs]
+        print(f"Running stage {name}...")
+        start = time.time()
+        with REPORT.measure("stage", name) as record:
+            value = stage.run(*inputs)
+            record["rows"] = count_rows(value)
+        print(f"Stage {name} took {time.time() - start} seconds")
+        self.values[name] = value
+        self.save_checkpoint(name, fingerprint, value)
+
+    # Returns the value of a stage, from memory, its checkpoint, or by running it
+    def value(self, name):
+        if name not in self.values:
+            if self.checkpoint_fingerprint(name) == self.fingerprint(name):
+                self.values[name] = self.load_checkpoint(name)
+            else:
+                self.execute(name)
+        return self.values[name]
+
+    # Returns the fingerprint of a stage
+    def fingerprint(self, name):
+        if name not in self.fingerprints:
+            stage = self.by_name[name]
+            description = {
+                "name": name,
+                "params": stage.params,
+                "inputs": [self.fingerprint(input_name) for input_name in stage.inputs]
+            }
+            rendered = json.dumps(description, sort_keys=True, default=str)
+            self.fingerprints[name] = hashlib.md5(rendered.encode()).hexdigest()
+        return self.fingerprints[name]
+
+    # Returns the fingerprint a stage's checkpoint was written with, None without a checkpoint
+    def checkpoint_fingerprint(self, name):
+        try:
+            with open(f"{self.checkpoint_dir}/{name}.json") as f:
+                return json.load(f)["fingerprint"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save_checkpoint(self, name, fingerprint, value):
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        if isinstance(value, pd.DataFrame):
+            tables = {None: value}
+        elif isinstance(value, dict):
+            tables = value
+        else:
+            tables = {}
+
+        try:
+            for key, df in tables.items():
+                path = self.checkpoint_path(name, key)
+                df.to_parquet(f"{path}.tmp", index=False)
+                os.replace(f"{path}.tmp", path)
+        except Exception as err:
+            print(f"Unable to checkpoint stage {name}...")
+            print(err)
+            return
+
+        # The json is written last, so a checkpoint only counts once all of its tables are on disk
+        checkpoint = {
+            "fingerprint": fingerprint,
+            "tables": None if isinstance(value, pd.DataFrame) else list(tables.keys()) if isinstance(value, dict) else [],
+            "created": time.time()
+        }
+        with open(f"{self.checkpoint_dir}/{name}.json.tmp", "w") as f:
+            json.dump(checkpoint, f, indent=4)
+        os.replace(f"{self.checkpoint_dir}/{name}.json.tmp", f"{self.checkpoint_dir}/{name}.json")
+
+    def load_checkpoint(self, name):
+        print(f"Loading stage {name} from checkpoint...")
+        with open(f"{self.checkpoint_dir}/{name}.json") as f:
+            tables = json.load(f)["tables"]
+        if tables is None:
+            return pd.read_parquet(self.checkpoint_path(name))
+        if len(tables) == 0:
+            return None
+        return {key: pd.read_parquet(self.checkpoint_path(name, key)) for key in tables}
+
+    def checkpoint_path(self, name, key=None):
+        if key is None:
+            return f"{self.checkpoint_dir}/{name}.parquet"
+        return f"{self.checkpoint_dir}/{name}.{key}.parquet"
@@ -1,21 +1,52 @@
 import os
 import sys
+import json
+import shutil
+from fnmatch import fnmatch
 from pathlib import Path
 from shutil import copyfile
-import synapseclient 
-import synapseutils
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+from release_parser import file_md5
+
+# synapseclient is only needed to log in, fetch_release_files also runs with any client passed in, ex. FakeSynapse
+try:
+	import synapseclient
+	import synapseutils
+except ImportError:
+	synapseclient = None
+	synapseutils = None
+
+# Release files the analysis reads, see ReleaseParser
+RELEASE_FILES = [
+	'data_mutations_extended_*.txt',
+	'data_clinical_sample*.txt',
+	'data_clinical_patient*.txt',
+	'data_gene_panel_*.txt',
+	'genomic_information*.txt',
+	'genie_combined.bed'
+]
 
 # Push and pull from synapse
+# client is an optional logged in synapseclient.Synapse, or any object with its getChildren and get
+# SYNAPSE_MAX_JOBS     concurrent downloads for fetch_release_files, default 4
+# RELEASES_DIR         where releases are written, default /app/releases
+# REFERENCE_PANEL_PATH panel added to every release, default /app/references/data_gene_panel_PHS-TRISEQ-V2.txt
 class SynapseGateway:
-	def __init__(self):
+	def __init__(self, client=None, max_jobs=None, releases_dir=None, reference_panel_path=None):
 	        load_dotenv(dotenv_path='/app/.env', verbose=True)
 
 	        self.synapse_username = str(os.getenv('SYNAPSE_USERNAME'))
 	        self.synapse_password = str(os.getenv('SYNAPSE_PASSWORD'))
+	        self.syn = client
+	        self.max_jobs = max_jobs or int(os.getenv('SYNAPSE_MAX_JOBS', 4))
+	        self.releases_dir = releases_dir or os.getenv('RELEASES_DIR', '/app/releases')
+	        self.reference_panel_path = reference_panel_path or os.getenv('REFERENCE_PANEL_PATH', '/app/references/data_gene_panel_PHS-TRISEQ-V2.txt')
 
 	def login(self):
 	    try:
+	    	if synapseclient is None:
+	    		raise ImportError("synapseclient is not installed")
 	    	self.syn = synapseclient.Synapse()
 	    	self.syn.login(self.synapse_username, self.synapse_password)
 	    except Exception as err:
@@ -23,12 +54,92 @@ class SynapseGateway:
 	        print(err)
 
 	def fetch_release(self, release):
-		path = f"/app/releases/{release}"
+		path = f"{self.releases_dir}/{release}"
 		synapseutils.syncFromSynapse(self.syn, release, followLink=True, path=path) 
+		self.add_reference_panel(path)
+
+	# Downloads only the release files the analysis needs, see RELEASE_FILES
+	# Files are fetched by max_jobs workers. Files whose MD5 already matches Synapse are skipped, and each download
+	# goes to its own {path}/.partial directory so an interrupted download resumes from synapseclient's partial file.
+	# {path}/manifest.json is rewritten as each file is verified, see ReleaseParser.check_manifest
+	# Returns the manifest
+	def fetch_release_files(self, release, patterns=RELEASE_FILES):
+		path = f"{self.releases_dir}/{release}"
+		Path(path).mkdir(parents=True, exist_ok=True)
+		entries = [entry for entry in self.list_release(release) if any(fnmatch(entry["name"], pattern) for pattern in patterns)]
+		print(f"Fetching {len(entries)} files of release {release} with {self.max_jobs} workers...")
+
+		manifest = {"release": release, "files": {}}
+		for entry in entries:
+			manifest["files"][entry["name"]] = dict(entry, verified=False)
+		with ThreadPoolExecutor(max_workers=self.max_jobs) as executor:
+			futures = {executor.submit(self.fetch_file, entry, path): entry for entry in entries}
+			for future in as_completed(futures):
+				entry = futures[future]
+				try:
+					future.result()
+					manifest["files"][entry["name"]]["verified"] = True
+				except Exception as err:
+					print(f"Unable to fetch {entry['name']}...")
+					print(err)
+				self.write_manifest(path, manifest)
+
+		self.add_reference_panel(path)
+		try:
+			os.rmdir(f"{path}/.partial") # only once every download finished
+		except OSError:
+			pass
+		missing = [name for name, entry in manifest["files"].items() if not entry["verified"]]
+		if len(missing) > 0:
+			print(f"{len(missing)} files were not fetched, re-run to resume: {missing}")
+		return manifest
 
-		# Check for 'PHS-TRISEQ-V2'
+	# Returns the files under a Synapse folder, following links and sub folders
+	# Each file is a dict of id, version, name, md5 and size
+	def list_release(self, parent):
+		entries = []
+		for child in self.syn.getChildren(parent, includeTypes=["file", "folder", "link"]):
+			if child["type"] == "org.sagebionetworks.repo.model.Folder":
+				entries.extend(self.list_release(child["id"]))
+				continue
+			entity = self.syn.get(child["id"], downloadFile=False, followLink=True)
+			file_handle = entity._file_handle
+			entries.append({
+				"id": entity.id,
+				"version": entity.versionNumber,
+				"name": entity.name,
+				"md5": file_handle["contentMd5"],
+				"size": file_handle["contentSize"]
+			})
+		return entries
+
+	# Downloads a listed file into path unless it is already there with the same MD5
+	# Returns True when the file was downloaded
+	def fetch_file(self, entry, path):
+		target = f"{path}/{entry['name']}"
+		if os.path.isfile(target) and os.path.getsize(target) == entry["size"] and file_md5(target) == entry["md5"]:
+			print(f"{entry['name']} is up to date")
+			return False
+
+		partial = f"{path}/.partial/{entry['id']}.{entry['version']}"
+		Path(partial).mkdir(parents=True, exist_ok=True)
+		print(f"Downloading {entry['name']}...")
+		entity = self.syn.get(entry["id"], version=entry["version"], downloadLocation=partial, ifcollision="overwrite.local")
+		if file_md5(entity.path) != entry["md5"]:
+			os.remove(entity.path)
+			raise ValueError(f"MD5 of {entry['name']} does not match Synapse")
+		os.replace(entity.path, target)
+		shutil.rmtree(partial, ignore_errors=True)
+		return True
+
+	# Write the manifest, then rename so a crash never leaves a partial manifest behind
+	def write_manifest(self, path, manifest):
+		with open(f"{path}/manifest.json.tmp", "w") as f:
+			json.dump(manifest, f, indent=4, sort_keys=True)
+		os.replace(f"{path}/manifest.json.tmp", f"{path}/manifest.json")
+
+	# Copy in the 'PHS-TRISEQ-V2' panel, missing from releases
+	def add_reference_panel(self, path):
 		target = Path(f"{path}/data_gene_panel_PHS-TRISEQ-V2.txt")
 		if not target.is_file():
-			copyfile("/app/references/data_gene_panel_PHS-TRISEQ-V2.txt", f"{path}/data_gene_panel_PHS-TRISEQ-V2.txt")
-			
-
+			copyfile(self.reference_panel_path, f"{path}/data_gene_panel_PHS-TRISEQ-V2.txt")
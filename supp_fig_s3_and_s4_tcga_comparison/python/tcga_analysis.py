@@ -3,14 +3,27 @@ import sys
 import pandas as pd
 from dotenv import load_dotenv
 from tcga_gateway import TcgaGateway
+from run_report import REPORT
+from frequency_intervals import FrequencyIntervals
 
 # Analysis of TCGA data
 class TcgaAnalysis:
-    def __init__(self):
+    def __init__(self, intervals=None):
         load_dotenv(dotenv_path='/app/.env', verbose=True)
 
         self.gateway = TcgaGateway()
         self.pcawg_samples = self.parse_pcawg_samples()
+        self.intervals = FrequencyIntervals(intervals) # adds tcga_mut_freq_lower/upper when FREQUENCY_INTERVALS is set
+
+        # Bulk mutation frequency results
+        # Key = cancer code
+        # Value = mutation frequency df
+        self.frequency_cache = {}
+
+        # Prefetched mutation frequency results
+        # Key = cancer code
+        # Value = Future that fills frequency_cache for the code
+        self.pending = {}
 
     # Mutation frequency is the number of samples that have a mutation within a gene \
     # divided by the total number of samples for a given cancer type
@@ -21,15 +34,34 @@ class TcgaAnalysis:
     # As such, we limit samples for TERT mutations to WGS assays identified in the PCAWG dataset
     # 
     # Returns a df of mutation frequencies for a given cancer code
+    # Waits on a prefetch, or slices the bulk results, when either covers this code
+    # Recorded per cohort in the run report, including any wait on a prefetch
     def mutation_frequency_by_cancer_code(self, code):
+        with REPORT.measure("frequencies", "tcga", code) as record:
+            if code in self.pending:
+                print(f"Waiting on prefetched TCGA mutation frequency for {code}")
+                self.pending.pop(code).result()
+            if code in self.frequency_cache:
+                df = self.frequency_cache[code].copy()
+            else:
+                df = self.fetch_mutation_frequency(code)
+            if self.intervals.method:
+                df = self.with_intervals(df)
+            record["rows"] = len(df)
+        return df
+
+    # Returns a frequency df with tcga_mut_freq_lower and tcga_mut_freq_upper, see FrequencyIntervals
+    # TCGA results are counts from BigQuery, so bootstrap intervals resample each gene's count binomially
+    def with_intervals(self, df):
+        lower, upper = self.intervals.binomial(df.tcga_gene_sample_count, df.tcga_total_sample_count)
+        df['tcga_mut_freq_lower'] = lower*100
+        df['tcga_mut_freq_upper'] = upper*100
+        return df
+
+    # Queries the mutation frequencies for a single cancer code
+    def fetch_mutation_frequency(self, code):
         print(f"Beginning calculation of TCGA mutation frequency for {code}")
         tert_df = self.tert_mutation_frequency_by_cancer_code(code)
-        try:
-            adjusted_tert_mf = tert_df.at[0, 'tcga_mut_freq']
-            tert_sample_count = tert_df.at[0, 'tcga_gene_sample_count']
-            pcawg_sample_count = tert_df.at[0, 'tcga_total_sample_count']
-        except:
-            adjusted_tert_mf = False
 
         query = '''
             WITH genes AS (
@@ -52,8 +84,19 @@ class TcgaAnalysis:
             ORDER BY tcga_mut_fraq DESC
         '''.format(code=code)
 
-        job = self.gateway.job(query)
-        target_df = job.to_dataframe()
+        target_df = self.gateway.query_dataframe(query)
+        return self.adjust_tert_frequency(code, target_df, tert_df)
+
+    # Applies the PCAWG restricted TERT results in tert_df to the TERT row of target_df
+    # The sample counts, and so the TCGA interval, are the pcawg subset's, the plotted tcga_mut_freq stays the full cohort's
+    def adjust_tert_frequency(self, code, target_df, tert_df):
+        try:
+            adjusted_tert_mf = tert_df.at[0, 'tcga_mut_freq']
+            tert_sample_count = tert_df.at[0, 'tcga_gene_sample_count']
+            pcawg_sample_count = tert_df.at[0, 'tcga_total_sample_count']
+        except:
+            adjusted_tert_mf = False
+
         if 'TERT' in target_df.values:
             try:
                 original_tert_mf = target_df.loc[target_df['Hugo_Symbol'] == 'TERT']['tcga_mut_freq'].tolist()[0]
@@ -78,6 +121,101 @@ class TcgaAnalysis:
 
         return target_df
 
+    # Returns a long df of mutation frequencies for a list of cancer codes
+    # One query grouped by (cohort, gene) replaces the two queries per code,
+    # the PCAWG sample count per cohort is fetched alongside for the TERT adjustment
+    # Per code results are cached for mutation_frequency_by_cancer_code
+    def mutation_frequency_by_cancer_codes(self, codes):
+        codes = list(dict.fromkeys(codes)) # drop duplicates, keep order
+        print(f"Beginning bulk calculation of TCGA mutation frequency for {len(codes)} cancer codes")
+        query = '''
+            WITH genes AS (
+                SELECT DISTINCT Hugo_Symbol FROM `project-genie-query-prod.consortium.mutation`
+            ), cohorts AS (
+                SELECT DISTINCT _TABLE_SUFFIX cohort, samplebarcode
+                FROM `isb-cgc.tcga_cohorts.*`
+                WHERE _TABLE_SUFFIX IN UNNEST ({codes})
+            ), pcawg AS (
+                SELECT DISTINCT sample_barcode FROM UNNEST ({pcawg_samples}) sample_barcode
+            ), tcga_mut AS (
+                SELECT cohorts.cohort, tcga_mut.Hugo_Symbol, tcga_mut.Variant_Type, tcga_mut.sample_barcode_tumor,
+                        pcawg.sample_barcode IS NOT NULL in_pcawg
+                FROM `isb-cgc.TCGA_hg38_data_v0.Somatic_Mutation` tcga_mut
+                JOIN cohorts ON tcga_mut.sample_barcode_tumor = cohorts.samplebarcode
+                LEFT JOIN pcawg ON tcga_mut.sample_barcode_tumor = pcawg.sample_barcode
+            ), tcga_data AS (
+                SELECT cohort,
+                        COUNT(DISTINCT sample_barcode_tumor) unique_samples,
+                        COUNT(DISTINCT IF(in_pcawg, sample_barcode_tumor, NULL)) pcawg_samples
+                FROM tcga_mut
+                GROUP BY cohort
+            ), gene_data AS (
+                SELECT tcga_mut.cohort, genes.Hugo_Symbol, COUNT(DISTINCT sample_barcode_tumor) gene_samples,
+                        COUNT(DISTINCT IF(in_pcawg, sample_barcode_tumor, NULL)) pcawg_gene_samples
+                FROM genes, tcga_mut
+                WHERE genes.Hugo_Symbol = tcga_mut.Hugo_Symbol
+                    AND tcga_mut.Variant_Type = 'SNP'
+                GROUP BY tcga_mut.cohort, genes.Hugo_Symbol
+            )
+            SELECT gene_data.cohort cancer_code,
+                    gene_data.Hugo_Symbol Hugo_Symbol,
+                    gene_data.gene_samples/tcga_data.unique_samples tcga_mut_fraq,
+                    SAFE_MULTIPLY(gene_data.gene_samples/tcga_data.unique_samples,100) tcga_mut_freq,
+                    gene_data.gene_samples tcga_gene_sample_count,
+                    tcga_data.unique_samples tcga_total_sample_count,
+                    gene_data.pcawg_gene_samples pcawg_gene_sample_count,
+                    tcga_data.pcawg_samples pcawg_total_sample_count
+                FROM gene_data JOIN tcga_data ON gene_data.cohort = tcga_data.cohort
+            ORDER BY cancer_code, tcga_mut_fraq DESC
+        '''.format(codes=codes, pcawg_samples=self.pcawg_samples)
+
+        df = self.gateway.query_dataframe(query)
+        columns = ['Hugo_Symbol', 'tcga_mut_fraq', 'tcga_mut_freq', 'tcga_gene_sample_count', 'tcga_total_sample_count']
+        for code in codes:
+            code_df = df.loc[df['cancer_code'] == code]
+            target_df = code_df[columns].reset_index(drop=True)
+            tert_df = self.bulk_tert_frequency(code_df)
+            self.frequency_cache[code] = self.adjust_tert_frequency(code, target_df, tert_df)
+        return df
+
+    # Submits the TCGA queries for codes to the gateway's worker pool and returns immediately
+    # bulk runs one grouped query for all codes, otherwise one job per code
+    # mutation_frequency_by_cancer_code waits on the pending result for its code
+    def prefetch_mutation_frequencies(self, codes, bulk=True):
+        codes = [code for code in dict.fromkeys(codes) if code not in self.frequency_cache and code not in self.pending]
+        if len(codes) == 0:
+            return
+        print(f"Prefetching TCGA mutation frequency for {len(codes)} cancer codes")
+        if bulk:
+            future = self.gateway.submit(self.mutation_frequency_by_cancer_codes, codes)
+            for code in codes:
+                self.pending[code] = future
+        else:
+            for code in codes:
+                self.pending[code] = self.gateway.submit(self.prefetch_mutation_frequency, code)
+
+    # Fetches and caches the mutation frequencies for a single cancer code
+    def prefetch_mutation_frequency(self, code):
+        self.frequency_cache[code] = self.fetch_mutation_frequency(code)
+
+    # Returns the tert_mutation_frequency_by_cancer_code result for one cohort of the bulk query
+    # TERT samples in PCAWG over the cohort's PCAWG samples, empty when either is missing
+    def bulk_tert_frequency(self, code_df):
+        tert = code_df.loc[code_df['Hugo_Symbol'] == 'TERT']
+        if len(tert) == 0:
+            return pd.DataFrame()
+        tert_sample_count = int(tert['pcawg_gene_sample_count'].iloc[0])
+        pcawg_sample_count = int(tert['pcawg_total_sample_count'].iloc[0])
+        if pcawg_sample_count == 0:
+            return pd.DataFrame() # the per code query fails on division by zero
+        return pd.DataFrame({
+            'Hugo_Symbol': ['TERT'],
+            'tcga_mut_fraq': [tert_sample_count/pcawg_sample_count],
+            'tcga_mut_freq': [tert_sample_count/pcawg_sample_count*100],
+            'tcga_gene_sample_count': [tert_sample_count],
+            'tcga_total_sample_count': [pcawg_sample_count]
+        })
+
     # Find mutation frequecy for samples containing TERT mutations within the PCAWG sample set
     def tert_mutation_frequency_by_cancer_code(self, code):
         query = '''
@@ -99,12 +237,13 @@ class TcgaAnalysis:
             WHERE genes.Hugo_Symbol = tcga_mut.Hugo_Symbol
                 AND tcga_mut.Variant_Type = 'SNP'
                 AND tcga_mut.sample_barcode_tumor IN (SELECT samplebarcode FROM `isb-cgc.tcga_cohorts.*` WHERE _TABLE_SUFFIX = '{code}')
+                AND tcga_mut.sample_barcode_tumor IN UNNEST ({pcawg_samples})
             GROUP BY genes.Hugo_Symbol
             ORDER BY tcga_mut_fraq DESC
         '''.format(code=code,pcawg_samples=self.pcawg_samples)
 
         try:
-            job = self.gateway.job(query).to_dataframe()
+            job = self.gateway.query_dataframe(query)
         except:
             job = pd.DataFrame() 
         return job
@@ -114,4 +253,4 @@ class TcgaAnalysis:
         self.pcawg_df = pd.read_csv(str(os.getenv("PCAWG_SUPPLEMENTARY_TABLE")), comment="#")
         spec_id = set(self.pcawg_df["submitted_specimen_id"].to_list())
         donor_id = set(self.pcawg_df["submitted_donor_id"].to_list())
-        return list(spec_id.union(donor_id))
\ No newline at end of file
+        return sorted(spec_id.union(donor_id)) # stable order keeps the TERT query cacheable
\ No newline at end of file
@@ -1,14 +1,39 @@
 import os
 import sys
+import json
+import time
+import hashlib
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import bigquery
 from google.oauth2 import service_account
 from dotenv import load_dotenv
+from run_report import REPORT
 
 # Push and pull from TCGA GBQ
+#
+# Query results are cached as parquet, keyed by the rendered SQL and parameters
+# TCGA_CACHE_DIR     cache location, default /app/releases/tcga_cache
+# TCGA_CACHE_TTL     seconds before a cached result is refetched, unset never expires
+# TCGA_OFFLINE       'true' serves only from the cache and never logs in
+# TCGA_MAX_JOBS      concurrent jobs for submit, default 4
 class TcgaGateway:
-    def __init__(self):
+    def __init__(self, cache_dir=None, ttl=None, offline=None, max_jobs=None):
         load_dotenv(dotenv_path='/app/.env', verbose=True)
-        self.login()
+        self.cache_dir = cache_dir or os.getenv('TCGA_CACHE_DIR', '/app/releases/tcga_cache')
+        self.ttl = ttl
+        if self.ttl == None and os.getenv('TCGA_CACHE_TTL'):
+            self.ttl = float(os.getenv('TCGA_CACHE_TTL'))
+        self.offline = offline
+        if self.offline == None:
+            self.offline = str(os.getenv('TCGA_OFFLINE')).lower() == 'true'
+
+        self.max_jobs = max_jobs or int(os.getenv('TCGA_MAX_JOBS', 4))
+        self.executor = None
+
+        self.client = None
+        if not self.offline:
+            self.login()
 
     def login(self):
         try:
@@ -20,5 +45,86 @@ class TcgaGateway:
             print("GBQ auth failed...")
             print(err)
 
-    def job(self, query):
-        return self.client.query(query)
\ No newline at end of file
+    def job(self, query, params=None):
+        if params:
+            return self.client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params))
+        return self.client.query(query)
+
+    # Runs fn(*args) on a bounded worker pool and returns its Future
+    # Used to overlap BigQuery jobs with local work
+    def submit(self, fn, *args):
+        if self.executor == None:
+            self.executor = ThreadPoolExecutor(max_workers=self.max_jobs)
+        return self.executor.submit(fn, *args)
+
+    # Returns a df of query results, served from the cache when possible
+    # params is an optional list of bigquery query parameters
+    # Each query is recorded in the run report with its rows and the bytes BigQuery processed
+    def query_dataframe(self, query, params=None):
+        key = self.cache_key(query, params)
+        with REPORT.measure("query", key[:16]) as record:
+            df = self.load_cached(key)
+            record["cached"] = df is not None
+            if df is None:
+                if self.offline:
+                    raise LookupError(f"TCGA query {key} is not cached and offline mode is on")
+                job = self.job(query, params)
+                df = job.to_dataframe()
+                record["bytes_processed"] = job.total_bytes_processed
+                self.save_cached(key, query, params, df)
+            else:
+                record["bytes_processed"] = 0
+            record["rows"] = len(df)
+        return df
+
+    # Returns the content address of a query
+    def cache_key(self, query, params=None):
+        rendered = {
+            "query": query.strip(),
+            "params": [param.to_api_repr() for param in params] if params else []
+        }
+        return hashlib.sha256(json.dumps(rendered, sort_keys=True).encode()).hexdigest()
+
+    # Returns a cached df, or None when missing or older than the ttl
+    def load_cached(self, key):
+        path = f"{self.cache_dir}/{key}.parquet"
+        if not os.path.isfile(path):
+            return None
+        age = time.time() - os.path.getmtime(path)
+        if self.ttl != None and age > self.ttl and not self.offline:
+            print(f"Cached TCGA query {key} is {int(age)} seconds old, refetching...")
+            return None
+        print(f"Loading TCGA query {key} from cache")
+        return pd.read_parquet(path)
+
+    # Writes a query result and its sql to the cache
+    def save_cached(self, key, query, params, df):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(f"{self.cache_dir}/{key}.json", "w") as f:
+                json.dump({
+                    "query": query,
+                    "params": [param.to_api_repr() for param in params] if params else [],
+                    "created": time.time()
+                }, f, indent=4)
+            # Write then rename so a crash never leaves a partial result behind
+            df.to_parquet(f"{self.cache_dir}/{key}.parquet.tmp", index=False)
+            os.replace(f"{self.cache_dir}/{key}.parquet.tmp", f"{self.cache_dir}/{key}.parquet")
+        except Exception as err:
+            print(f"Unable to cache TCGA query {key}...")
+            print(err)
+
+    # Removes cached results
+    # Removes a single query's result when given, otherwise the whole cache
+    def clear_cache(self, query=None, params=None):
+        if not os.path.isdir(self.cache_dir):
+            return
+        if query != None:
+            keys = [self.cache_key(query, params)]
+        else:
+            keys = [name.split(".")[0] for name in os.listdir(self.cache_dir)]
+        for key in set(keys):
+            for suffix in [".parquet", ".json"]:
+                path = f"{self.cache_dir}/{key}{suffix}"
+                if os.path.isfile(path):
+                    os.remove(path)
@@ -1,17 +1,19 @@
 import os
-import glob
 import time
-import math
+import shutil
+import argparse
 from pathlib import Path
 from numpy.core.numeric import roll
 import pandas as pd
 from dotenv import load_dotenv
-import matplotlib.pyplot as plt
-from adjustText import adjust_text
 from tcga_gateway import TcgaGateway
 from genie_analysis import GenieAnalysis
 from tcga_analysis import TcgaAnalysis
-from plot import Plot
+from plot_queue import PlotQueue
+from deviation_metrics import DeviationMetrics
+from comparison_results import ComparisonResults
+from stage_graph import StageGraph
+from run_report import REPORT
 
 # Compare TCGA and GENIE data
 class TcgaGenieComparison:
@@ -21,16 +23,28 @@ class TcgaGenieComparison:
         self.gateway = TcgaGateway()
         self.genie_analysis = GenieAnalysis(str(os.getenv('SYNAPSE_RELEASE_ID')), str(os.getenv('SYNAPSE_RELEASE_VERSION')))
         self.tcga_analysis = TcgaAnalysis()
+        self.plots = PlotQueue()
+        self.results = {}
+        # Optional previous release whose plots are reused, see reuse_cohort_plots
+        self.previous_release_version = os.getenv('PREVIOUS_RELEASE_VERSION')
 
     # Driver code to generate plots
-    def execute(self):
-        start = time.time()
-        self.create_infrastructure()
-        self.process_data(rollup=True)
-        self.process_data(rollup=False)
-        self.handle_deviations()
+    # start and only select stages to re-run, see StageGraph.run
+    def execute(self, start=None, only=None):
+        start_time = time.time()
+        REPORT.reset()
+        try:
+            self.create_infrastructure()
+            self.stages().run(start, only)
+        finally:
+            self.write_report()
         end = time.time()
-        print(f"Process took {end - start} seconds")
+        print(f"Process took {end - start_time} seconds")
+
+    # Write the run report of every recorded stage, query, cohort and plot to /app/outputs/VERSION/run_report.json
+    def write_report(self):
+        REPORT.write(f"/app/outputs/{os.getenv('SYNAPSE_RELEASE_VERSION')}/run_report.json",
+            os.getenv('SYNAPSE_RELEASE_ID'), os.getenv('SYNAPSE_RELEASE_VERSION'))
 
     # Create output directory structure
     def create_infrastructure(self):
@@ -46,41 +60,149 @@ class TcgaGenieComparison:
             Path(f"/app/outputs/{os.getenv('SYNAPSE_RELEASE_VERSION')}/rollup/{target}").mkdir(parents=True, exist_ok=True)
             Path(f"/app/outputs/{os.getenv('SYNAPSE_RELEASE_VERSION')}/rollup/no_tert/{target}").mkdir(parents=True, exist_ok=True)
 
-    # Calculate counts, MF, and draw plots
+    # Returns the pipeline as a graph of checkpointed stages
+    # parse -> GENIE frequencies per pass, TCGA frequencies -> merge -> metrics -> plots, then the deviations
+    # Checkpoints live under /app/outputs/VERSION/checkpoints
+    def stages(self):
+        cancer_codes = self.genie_analysis.cancer_codes["cancer_codes"]
+        tcga_codes = [arr["tcga_cancer_code"] for arr in cancer_codes]
+        genie_codes = [arr["genie_cancer_code"] for arr in cancer_codes]
+        passes = [[True, "rollup"], [False, "direct"]]
+
+        graph = StageGraph(f"/app/outputs/{os.getenv('SYNAPSE_RELEASE_VERSION')}/checkpoints")
+        graph.add("parse", self.parse_release, params=self.genie_analysis.parser.source_fingerprint())
+        for rollup, name in passes:
+            graph.add(f"genie_frequencies_{name}", lambda parsed, rollup=rollup: self.genie_frequencies(genie_codes, tcga_codes, rollup),
+                inputs=["parse"], params={"codes": genie_codes, "rollup": rollup, "panel_denominators": self.genie_analysis.panel_denominators,
+                    "intervals": self.genie_analysis.intervals.params()})
+        graph.add("tcga_frequencies", lambda: self.tcga_frequencies(tcga_codes),
+            params={"codes": tcga_codes, "pcawg_samples": self.tcga_analysis.pcawg_samples, "intervals": self.tcga_analysis.intervals.params()})
+        for rollup, name in passes:
+            graph.add(f"merge_{name}", lambda genie_df, tcga_df, rollup=rollup: self.merge(cancer_codes, genie_df, tcga_df, rollup),
+                inputs=[f"genie_frequencies_{name}", "tcga_frequencies"], params={"cancer_codes": cancer_codes})
+        for rollup, name in passes:
+            graph.add(f"metrics_{name}", lambda table, rollup=rollup: self.metrics(table, rollup),
+                inputs=[f"merge_{name}"])
+        for rollup, name in passes:
+            graph.add(f"plots_{name}", lambda table, metrics, parsed, rollup=rollup: self.process_plots(table, metrics, rollup),
+                inputs=[f"merge_{name}", f"metrics_{name}", "parse"])
+        # Deviations compute their own GENIE frequencies, so they take the settings the genie_frequencies stages are keyed on
+        graph.add("deviations", lambda parsed, tcga_df: self.handle_deviations(),
+            inputs=["parse", "tcga_frequencies"], params={"panel_denominators": self.genie_analysis.panel_denominators,
+                "intervals": self.genie_analysis.intervals.params()})
+        return graph
+
+    # Calculate counts, MF, and draw plots for one pass
     def process_data(self, rollup=False):
+        try:
+            self.stages().run(only=["rollup" if rollup else "direct"])
+        finally:
+            self.write_report()
+
+    # Parses the release, or loads it from the parser's cache
+    def parse_release(self):
+        self.genie_analysis.parser.parse_all()
+
+    # Returns a long df of GENIE mutation frequencies for every cancer code
+    def genie_frequencies(self, genie_codes, tcga_codes, rollup=False):
+        # Start the TCGA query in the background, then compute GENIE frequencies for every cancer code in one pass
+        self.tcga_analysis.prefetch_mutation_frequencies(tcga_codes)
+        return self.genie_analysis.mutation_frequency_by_cancer_codes(genie_codes, rollup)
+
+    # Returns a stage's checkpointed value from the previous release's outputs, None if there is none
+    def previous_checkpoint(self, name):
+        if self.previous_release_version is None:
+            return None
+        graph = StageGraph(f"/app/outputs/{self.previous_release_version}/checkpoints")
+        if graph.checkpoint_fingerprint(name) is None:
+            return None
+        try:
+            return graph.load_checkpoint(name)
+        except Exception as err:
+            print(f"Unable to load stage {name} of release {self.previous_release_version}...")
+            print(err)
+            return None
+
+    # Returns a long df of TCGA mutation frequencies for every cancer code
+    def tcga_frequencies(self, tcga_codes):
+        frames = []
+        for code in dict.fromkeys(tcga_codes):
+            df = self.tcga_analysis.mutation_frequency_by_cancer_code(code)
+            df.insert(0, 'cancer_code', code)
+            frames.append(df)
+        return pd.concat(frames, ignore_index=True)
+
+    # Merges the TCGA and GENIE frequencies of every cohort into a ComparisonResults
+    # Writes each cohort's raw_data TSV and returns the results table
+    def merge(self, cancer_codes, genie_df, tcga_df, rollup=False):
         outpath = self.find_outpath(rollup)
         print(f"Outpath is {outpath}")
-        sample_counts_comparison = []
-        rmsd_comparison = [] #tcga_cancer_code, genie_cancer_code, rmsd, wrmsd
-        cancer_codes = self.genie_analysis.cancer_codes["cancer_codes"]
-        for i, arr in enumerate(cancer_codes):
+        results = self.results[rollup] = ComparisonResults()
+        for arr in cancer_codes:
             tcga_cancer_code = arr["tcga_cancer_code"]
             genie_cancer_code = arr["genie_cancer_code"]
-            cancer_type_label = arr["cancer_type_label"]
+            genie_code = self.genie_analysis.oncotree_rollup_code(genie_cancer_code) if rollup else genie_cancer_code
 
             print(f"Generating results for TCGA code: {tcga_cancer_code}, GENIE code: {genie_cancer_code}")
-            result = self.frequency_count_data(tcga_cancer_code, genie_cancer_code, rollup)
-            rmsd, wrmsd = self.rmsd_by_cancer_type(result)
-            rmsd_comparison.append([tcga_cancer_code, genie_cancer_code, rmsd, wrmsd])
-            result.to_csv(f"{outpath}/raw_data/{genie_cancer_code}_results.tsv", sep='\t', index=True)
-
-            try:
-                sample_counts_comparison.append([genie_cancer_code, 
-                        result.tcga_total_sample_count.unique().tolist()[0], 
-                        result.genie_total_sample_count.unique().tolist()[0]])
-            except:
-                print(f"Unable to parse out sample counts for {tcga_cancer_code}")
-
-            # Generate plots
+            with REPORT.measure("merge", f"merge_{'rollup' if rollup else 'direct'}", genie_cancer_code) as record:
+                result = pd.merge(self.cancer_code_frequencies(tcga_df, tcga_cancer_code),
+                    self.cancer_code_frequencies(genie_df, genie_code), on='Hugo_Symbol')
+                results.add(tcga_cancer_code, genie_cancer_code, result)
+                results.write_cohort(outpath, genie_cancer_code)
+                record["rows"] = len(result)
+        return results.table
+
+    # Returns the rows of a long frequency df for one cancer code
+    def cancer_code_frequencies(self, df, code):
+        return df.loc[df['cancer_code'] == code].drop(columns='cancer_code').reset_index(drop=True)
+
+    # Returns the comparison results of a pass, rebuilt from its table when loaded from a checkpoint
+    def comparison_results(self, table, rollup=False):
+        if rollup not in self.results:
+            cancer_codes = self.genie_analysis.cancer_codes["cancer_codes"]
+            cohorts = [[arr["tcga_cancer_code"], arr["genie_cancer_code"]] for arr in cancer_codes]
+            self.results[rollup] = ComparisonResults.from_table(cohorts, table)
+        return self.results[rollup]
+
+    # Calculates RMSD by gene and by cancer type, writes them to raw_data and returns both
+    def metrics(self, table, rollup=False):
+        outpath = self.find_outpath(rollup)
+        results = self.comparison_results(table, rollup)
+
+        rmsd_gene_df = results.rmsd_by_gene()
+        rmsd_gene_df.sort_values('rmsd', inplace=True, ascending=False)
+        rmsd_gene_df.to_csv(f"{outpath}/raw_data/rmsd_by_gene_raw.tsv", sep='\t', index=False)
+
+        # Kept in cohort order for the plots, written sorted by RMSD
+        rmsd_df = results.rmsd_by_cancer_type()
+        rmsd_df.sort_values('rmsd', ascending=False).to_csv(f"{outpath}/raw_data/rmsd_by_cancer_type.tsv", sep='\t', index=False)
+        return {"rmsd_by_gene": rmsd_gene_df, "rmsd_by_cancer_type": rmsd_df}
+
+    # Draws every plot of a pass
+    def process_plots(self, table, metrics, rollup=False):
+        outpath = self.find_outpath(rollup)
+        results = self.comparison_results(table, rollup)
+        rmsd_df = metrics["rmsd_by_cancer_type"]
+        previous = self.previous_checkpoint(f"merge_{'rollup' if rollup else 'direct'}")
+        if previous is not None:
+            previous = ComparisonResults.from_table(results.cohorts, previous)
+        for i, arr in enumerate(self.genie_analysis.cancer_codes["cancer_codes"]):
+            tcga_cancer_code = arr["tcga_cancer_code"]
+            genie_cancer_code = arr["genie_cancer_code"]
+            cancer_type_label = arr["cancer_type_label"]
+            result = results.cohort(genie_cancer_code)
+            rmsd = rmsd_df.rmsd.iat[i]
+            wrmsd = rmsd_df.wrmsd.iat[i]
+
+            if self.reuse_cohort_plots(previous, result, tcga_cancer_code, genie_cancer_code, cancer_type_label, rollup):
+                continue
             self.mutation_frequencies(result, tcga_cancer_code, genie_cancer_code, cancer_type_label, rmsd, wrmsd, rollup)
             self.sample_counts_by_gene(result, tcga_cancer_code, genie_cancer_code, cancer_type_label, rollup)
             print(" ")
 
-        # rmsd by gene calcs and plots
-        rmsd_by_gene = self.rmsd_by_gene(outpath)
-        rmsd_gene_df = pd.DataFrame(rmsd_by_gene, columns = ['gene', 'rmsd', 'wrmsd', 'error_sum', 'cancer_type_count'])
+        # rmsd by gene plots
+        rmsd_gene_df = metrics["rmsd_by_gene"].copy()
         rmsd_gene_df.sort_values('rmsd', inplace=True, ascending=False)
-        rmsd_gene_df.to_csv(f"{outpath}/raw_data/rmsd_by_gene_raw.tsv", sep='\t', index=False)
         # Filter to genes in at least 3 cancer types
         print(rmsd_gene_df)
         drop_targets = rmsd_gene_df[rmsd_gene_df['cancer_type_count'] < 3].index
@@ -89,118 +211,55 @@ class TcgaGenieComparison:
  
         # Sort by RMSD
         rmsd_gene_df.sort_values('rmsd', inplace=True, ascending=False)
-        Plot.rmsd_by_gene(outpath, rmsd_gene_df, 'rmsd_by_gene')
+        self.plots.add('rmsd_by_gene', outpath, rmsd_gene_df, 'rmsd_by_gene')
         # Sort by wRMSD
         rmsd_gene_df.sort_values('wrmsd', inplace=True, ascending=False)
-        Plot.rmsd_by_gene(outpath, rmsd_gene_df, 'wrmsd_by_gene')
+        self.plots.add('rmsd_by_gene', outpath, rmsd_gene_df, 'wrmsd_by_gene')
         # Drop TERT
         rmsd_gene_df.drop(rmsd_gene_df[rmsd_gene_df['gene'] == 'TERT'].index, inplace = True)
         # Sort by RMSD
         rmsd_gene_df.sort_values('rmsd', inplace=True, ascending=False)
-        Plot.rmsd_by_gene(outpath, rmsd_gene_df, 'rmsd_by_gene_no_tert')
+        self.plots.add('rmsd_by_gene', outpath, rmsd_gene_df, 'rmsd_by_gene_no_tert')
         # Sort by wRMSD
         rmsd_gene_df.sort_values('wrmsd', inplace=True, ascending=False)
-        Plot.rmsd_by_gene(outpath, rmsd_gene_df, 'wrmsd_by_gene_no_tert')
+        self.plots.add('rmsd_by_gene', outpath, rmsd_gene_df, 'wrmsd_by_gene_no_tert')
         # Sort by Error Sum
         rmsd_gene_df.sort_values('error_sum', inplace=True, ascending=False)
-        Plot.error_sum_by_gene(outpath, rmsd_gene_df)
-
-
-        # Calculate rmsd by cancer type
-        rmsd_df = pd.DataFrame(rmsd_comparison, columns = ['tcga_cancer_code', 'genie_cancer_code', 'rmsd', 'wrmsd']) 
-        rmsd_df.sort_values('rmsd', inplace=True, ascending=False)
-        rmsd_df.to_csv(f"{outpath}/raw_data/rmsd_by_cancer_type.tsv", sep='\t', index=False)
+        self.plots.add('error_sum_by_gene', outpath, rmsd_gene_df)
 
         # Aggregate sample plots
         print("Generateing aggregate plots...")
-        self.sample_counts_by_cancer_type(sample_counts_comparison, rollup)
+        self.sample_counts_by_cancer_type(results.sample_counts(), rollup)
         self.genie_oncotree_distribution(rollup)
+        self.plots.render()
         print(f"Done processing data for all cancer codes. Rollup was {str(rollup)}")
 
+    # Copies a cohort's plots from the previous release when its results have not changed
+    # Returns True when every plot of the cohort was reused
+    def reuse_cohort_plots(self, previous, result, tcga_cancer_code, genie_cancer_code, cancer_type_label, rollup=False):
+        if previous is None or [tcga_cancer_code, genie_cancer_code] not in previous.cohorts:
+            return False
+        if not previous.cohort(genie_cancer_code).equals(result):
+            return False
 
-    def rmsd_by_gene(self, outpath):
-        print(f"Calculating RMSD and wRMSD by gene.")
-        gene_dict = {}
-        for cancer_results_path in glob.glob(f"{outpath}/raw_data/*"):
-            if 'rmsd' in cancer_results_path or 'RMSD' in cancer_results_path:
-                continue
-            with open(cancer_results_path, "r") as f:
-                for line in f:
-                    spl = line.split("\t")
-                    gene = spl[1]
-                    tcga_mut_freq = spl[3]
-                    genie_mut_freq = spl[7]
-
-                    if gene in gene_dict:
-                        gene_dict[gene].append([tcga_mut_freq, genie_mut_freq])
-                    else:
-                        gene_dict[gene] = [[tcga_mut_freq, genie_mut_freq]]
-        rmsd_by_gene = []
-        for gene, mut_freqs in gene_dict.items():
-            if gene == "Hugo_Symbol":
-                continue
-            absolute_sum = []
-            err = []
-            weighted_err = []
-            for arr in mut_freqs:
-                mut_freq_x = float(arr[0]) #tcga
-                mut_freq_y = float(arr[1]) #genie
-                
-                # calculate absolute distance from point to y=x
-                if mut_freq_y == mut_freq_x:
-                    err.append(0)
-                    weighted_err.append(0)
-                    absolute_sum.append(0)
-                elif mut_freq_x > mut_freq_y:
-                    hyp = mut_freq_x - mut_freq_y
-                    opp = hyp * math.sin(math.radians(45))
-                    err.append(opp)
-                    absolute_sum.append(opp)
-                    weighted_err.append(opp*mut_freq_x/100)
-                elif mut_freq_y > mut_freq_x:
-                    hyp = mut_freq_y - mut_freq_x
-                    adj = hyp * math.cos(math.radians(45))
-                    err.append(adj)
-                    absolute_sum.append(adj)
-                    weighted_err.append(adj*mut_freq_y/100)
-            
-            error_sum = sum(absolute_sum)
-            cancer_type_count = len(absolute_sum)
-            mse = sum([x**2 for x in err]) / len(err)
-            rmsd = round(mse**0.5, 2)
-            weighted_mse = sum([x**2 for x in weighted_err]) / len(weighted_err)
-            wrmsd = round(weighted_mse**0.5, 2)
-            rmsd_by_gene.append([gene, rmsd, wrmsd, error_sum, cancer_type_count])
-        return rmsd_by_gene
+        cancer_underscore = cancer_type_label.replace(" ", "_")
+        targets = [
+            f"mutation_frequencies/{cancer_underscore}.png",
+            f"no_tert/mutation_frequencies/{cancer_underscore}.png",
+            f"sample_counts_by_gene/{genie_cancer_code}_sample_counts.png"
+        ]
+        previous_outpath = self.find_outpath(rollup, self.previous_release_version)
+        outpath = self.find_outpath(rollup)
+        if not all(os.path.exists(f"{previous_outpath}/{target}") for target in targets):
+            return False
+        print(f"Results for GENIE code {genie_cancer_code} are unchanged, reusing plots of release {self.previous_release_version}")
+        for target in targets:
+            shutil.copyfile(f"{previous_outpath}/{target}", f"{outpath}/{target}")
+        return True
 
     def rmsd_by_cancer_type(self, result):
-        err = []
-        weighted_err = []
-        for i, row in result.iterrows():
-            mut_freq_x = row['tcga_mut_freq']
-            mut_freq_y = row['genie_mut_freq']
-
-            # calculate absolute distance from point to y=x
-            if mut_freq_y == mut_freq_x:
-                err.append(0)
-                weighted_err.append(0)
-            elif mut_freq_x > mut_freq_y:
-                hyp = mut_freq_x - mut_freq_y
-                opp = hyp * math.sin(math.radians(45))
-                err.append(opp)
-                weighted_err.append(opp*mut_freq_x/100)
-            elif mut_freq_y > mut_freq_x:
-                hyp = mut_freq_y - mut_freq_x
-                adj = hyp * math.cos(math.radians(45))
-                err.append(adj)
-                weighted_err.append(adj*mut_freq_y/100)
-        # mse = (1/n) * sum[ (acual - pred)**2 ]
-        # rmsd = sqrt(mse)
-        mse = sum([x**2 for x in err]) / len(err)
-        rmsd = round(mse**0.5, 2)
+        rmsd, wrmsd = DeviationMetrics.rmsd(result)
         print(f"Calculated RMSD of {rmsd}")
-        weighted_mse = sum([x**2 for x in weighted_err]) / len(weighted_err)
-        wrmsd = round(weighted_mse**0.5, 2)
         print(f"Calculated wRMSD of {wrmsd}")
 
         return rmsd, wrmsd
@@ -218,13 +277,11 @@ class TcgaGenieComparison:
 
         # Generate plot...
         print(f"Plotting mutation frequency results for TCGA cancer code: {tcga_cancer_code}")
-        Plot.reset()
-        Plot.mutation_frequencies(outpath, str(os.getenv('SYNAPSE_RELEASE_VERSION')), result, genie_cancer_code, tcga_cancer_code, cancer_type_label, rmsd, wrmsd)
+        self.plots.add('mutation_frequencies', outpath, str(os.getenv('SYNAPSE_RELEASE_VERSION')), result, genie_cancer_code, tcga_cancer_code, cancer_type_label, rmsd, wrmsd, cohort=genie_cancer_code)
         # Plots without TERT...
         try:
             result.drop(result[result['Hugo_Symbol'] == 'TERT'].index, inplace = True)
-            Plot.reset()
-            Plot.mutation_frequencies(f"{outpath}/no_tert", str(os.getenv('SYNAPSE_RELEASE_VERSION')), result, genie_cancer_code, tcga_cancer_code, cancer_type_label, rmsd, wrmsd)
+            self.plots.add('mutation_frequencies', f"{outpath}/no_tert", str(os.getenv('SYNAPSE_RELEASE_VERSION')), result, genie_cancer_code, tcga_cancer_code, cancer_type_label, rmsd, wrmsd, cohort=genie_cancer_code)
         except Exception as e:
             print(e)
             print(f"Error in creating plot without TERT...")
@@ -251,46 +308,47 @@ class TcgaGenieComparison:
         result.drop(indecies_to_drop, inplace=True)
         # Generate plot...
         print(f"Plotting sample counts by gene results for TCGA cancer code: {tcga_cancer_code}")
-        Plot.reset()
-        Plot.sample_counts_by_gene(outpath, 
+        self.plots.add('sample_counts_by_gene', outpath, 
             str(os.getenv('SYNAPSE_RELEASE_VERSION')), 
             result, 
             genie_cancer_code, 
-            cancer_type_label)
+            cancer_type_label,
+            cohort=genie_cancer_code)
 
     # Plot total sample counts by cancer type for GENIE and TCGA cohorts
     def sample_counts_by_cancer_type(self, result, rollup=False):
         outpath = self.find_outpath(rollup)
         print(f"Plotting total sample count results...")
-        Plot.reset()
-        Plot.sample_counts_by_cancer_type(outpath, 
+        self.plots.add('sample_counts_by_cancer_type', outpath, 
             str(os.getenv('SYNAPSE_RELEASE_VERSION')), 
             result)
 
     # Plot total sample counts by cancer type for GENIE and TCGA cohorts
     # Limit to top 40 cancer types
+    # sample_count_by_cancer_type is already sorted, by count then code, with a fresh index
     def genie_oncotree_distribution(self, rollup=False):
         outpath = self.find_outpath(rollup)
         result = self.genie_analysis.sample_count_by_cancer_type(rollup)
         indecies_to_drop = [] # captures the row index where mutation gene is not in panel  
-        result.sort_values('sample_count', inplace=True, ascending=False)
         for i, row in result.iterrows():
             if i >= 40:
                 indecies_to_drop.append(i) # Add to drop list
                 continue
         result.drop(indecies_to_drop, inplace=True)
         print(f"Plotting GENIE sample count bargraph...")
-        Plot.reset()
-        Plot.genie_oncotree_distribution(outpath, 
+        self.plots.add('genie_oncotree_distribution', outpath, 
             str(os.getenv('SYNAPSE_RELEASE_VERSION')), 
             result)
 
     # Returns the output path depending on if a rollup oncotree code is used
-    def find_outpath(self, rollup=True):
+    # version defaults to SYNAPSE_RELEASE_VERSION
+    def find_outpath(self, rollup=True, version=None):
+        if version is None:
+            version = os.getenv('SYNAPSE_RELEASE_VERSION')
         if rollup:
-            return f"/app/outputs/{os.getenv('SYNAPSE_RELEASE_VERSION')}/rollup"
+            return f"/app/outputs/{version}/rollup"
         else:
-            return f"/app/outputs/{os.getenv('SYNAPSE_RELEASE_VERSION')}/direct_comparison"
+            return f"/app/outputs/{version}/direct_comparison"
 
     # One-off cases that deviate from regular analysis pipeline
     def handle_deviations(self):
@@ -308,6 +366,7 @@ class TcgaGenieComparison:
             ["BRCA", "Breast Invasive Carcinoma", "ILC", False]
         ]
 
+        self.tcga_analysis.prefetch_mutation_frequencies([arr[0] for arr in targets])
         for arr in targets:
             tcga_cancer_code = arr[0]
             cancer_type_label = arr[1]
@@ -321,119 +380,13 @@ class TcgaGenieComparison:
             results = pd.merge(tcga_mutation_frequencies, genie_mutation_frequencies, on='Hugo_Symbol')
             results.to_csv(f"{outpath}/{genie_cancer_code}_results.tsv", sep='\t', index=True)
             results.drop(results[results['Hugo_Symbol'] == 'TERT'].index, inplace = True)
-            Plot.reset()
-
-            # Get sample counts for axes title
-            try:
-                tcga_total_sample_count = results.tcga_total_sample_count.unique().tolist()[0]
-                genie_total_sample_count = results.genie_total_sample_count.unique().tolist()[0]
-            except:
-                tcga_total_sample_count = 'UNK'
-                genie_total_sample_count = 'UNK'
-
-            # Fetch mutation frequency results from df
-            tcga_mut_freq = results.tcga_mut_freq.tolist()
-            genie_mut_freq = results.genie_mut_freq.tolist()
-
-            # General plot details
-            sup_title_text = f"{cancer_type_label} Mutation Frequency"
-            title_text = f"Oncotree: {genie_cancer_code} TCGA: {tcga_cancer_code}"
-            plt.style.use('ggplot')
-            plt.style.use('seaborn-whitegrid')
-            plt.figure(figsize=(10,10))
-            plt.xlim(0, 100)
-            plt.ylim(0, 100)
-            plt.title(title_text, fontsize='x-large')
-            plt.suptitle(sup_title_text, fontsize='xx-large') 
-            plt.xlabel(f"TCGA Mutation Frequency (%)\nN={tcga_total_sample_count}", fontsize='x-large')
-            plt.ylabel(f"GENIE Mutation Frequency (%)\nN={genie_total_sample_count}", fontsize='x-large')
-
-            # Dividing line
-            div_x = [0,100]
-            div_y = [0,100]
-            plt.plot(div_x, div_y, color='lightgray')
-
-            # Scatter
-            plt.scatter(tcga_mut_freq, genie_mut_freq, marker='o', color='k', alpha=0.9)
-
-            # Handle point labels
-            spent_index = []
-            annotations = []
-            genes = []
-            delta_dict = {}
-            leftovers = {}
-            for i, txt in enumerate(results.Hugo_Symbol):
-                genes.append(txt)
-                # Add a label if:
-                #   a). TCGA or GENIE mut_freq meets min threshold
-                #   a). Delta signifies cohort discrep
-                tcga_mut_freq = results.tcga_mut_freq.iat[i]
-                genie_mut_freq = results.genie_mut_freq.iat[i]
-                delta = abs(genie_mut_freq - tcga_mut_freq)
-                # Parse out secondary targets, and then leftovers
-                if (genie_mut_freq >= 5 and tcga_mut_freq >= 5) or (genie_mut_freq >= 1 and delta > 10) or (tcga_mut_freq >= 1 and delta > 10):
-                    delta_dict[i] = delta
-                else:
-                    leftovers[i] = delta
-
-                # Handle outliers AKA primary targets
-                if (tcga_mut_freq > 30 or 
-                    genie_mut_freq > 30 or 
-                    (genie_mut_freq > 20 and tcga_mut_freq > 10) or
-                    (tcga_mut_freq > 20 and genie_mut_freq > 10) or
-                    delta > 25):
-                    # Old annotation method...
-                    #   plt.annotate(txt, (results.mut_fraq_x.iat[i] + 1, results.mut_fraq_y.iat[i]))
-                    # 
-                    # New annotation method with adjust_text spacing...
-                    spent_index.append(i)
-                    annotations.append(plt.text(results.tcga_mut_freq.iat[i], results.genie_mut_freq.iat[i], txt))
-
-            # Get a min number of labels based upon delta threshold
-            label_min = 8
-            axis_min = 3
-            if (len(annotations) <= label_min and len(delta_dict.items()) > 0):
-                index_list = []
-                delta_list = []
-                for key, value in delta_dict.items():
-                    index_list.append(key)
-                    delta_list.append(value)
-
-                index_list, delta_list = zip(*sorted(zip(index_list, delta_list)))
-                index_list, delta_list = (list(x) for x in zip(*sorted(zip(index_list, delta_list))))
-                while (len(annotations) <= label_min):
-                    target_i = index_list.pop(0)
-                    if (target_i not in spent_index):
-                        spent_index.append(i)
-                        annotations.append(plt.text(results.tcga_mut_freq.iat[target_i], results.genie_mut_freq.iat[target_i], genes[target_i]))
-                    if len(index_list) == 0:
-                        break
-                        
-            # If you got to this point, all the points are hugging the axis.
-            if (len(annotations) <= axis_min and len(leftovers.items()) > 0):
-                index_list = []
-                delta_list = []
-                for key, value in leftovers.items():
-                    index_list.append(key)
-                    delta_list.append(value)
-
-                index_list, delta_list = zip(*sorted(zip(index_list, delta_list)))
-                index_list, delta_list = (list(x) for x in zip(*sorted(zip(index_list, delta_list))))
-                while (len(annotations) <= axis_min):
-                    target_i = index_list.pop(0)
-                    if (target_i not in spent_index):
-                        spent_index.append(i)
-                        annotations.append(plt.text(results.tcga_mut_freq.iat[target_i], results.genie_mut_freq.iat[target_i], genes[target_i]))
-                    if len(index_list) == 0:
-                        break
-
-            # Use adjustText to help point label overlap...
-            # Arrows can be removed to just have text labels
-            # Sample arrow code:
-            #   arrowprops=dict(arrowstyle="-", color='dimgray', lw=0.5)
-            adjust_text(annotations, arrowprops=dict(arrowstyle="-", color='dimgray', lw=0.5))
-
-            # Generate plot
-            plt.tight_layout()
-            cancer_underscore = cancer_type_label.replace(" ", "_")
-            plt.savefig(f"{outpath}/{genie_cancer_code}_{cancer_underscore}.png")
\ No newline at end of file
+            self.plots.add('deviation_frequencies', outpath, results, genie_cancer_code, tcga_cancer_code, cancer_type_label, cohort=genie_cancer_code)
+        self.plots.render()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare TCGA and GENIE mutation frequencies")
+    parser.add_argument('--from', dest='start', help="re-run this stage and every stage after it, ex. plots")
+    parser.add_argument('--only', nargs='+', help="re-run just these stages, ex. plots or metrics_rollup")
+    args = parser.parse_args()
+    TcgaGenieComparison().execute(args.start, args.only)
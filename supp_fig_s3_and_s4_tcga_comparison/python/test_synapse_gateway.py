@@ -0,0 +1,92 @@
+import os
+import json
+from pathlib import Path
+import pytest
+
+from fake_synapse import FakeSynapse
+from release_parser import ReleaseParser
+from synapse_gateway import SynapseGateway
+
+RELEASE = "synFAKE"
+VERSION = "F1"
+REFERENCE_PANEL = Path(__file__).resolve().parent.parent / "references" / "data_gene_panel_PHS-TRISEQ-V2.txt"
+
+# Fake release with the files fetch_release_files keeps, one of them in a sub folder, and one it skips
+@pytest.fixture
+def syn():
+    syn = FakeSynapse()
+    syn.add_folder(None, RELEASE)
+    syn.ids = {
+        "mutations": syn.add_file(RELEASE, f"data_mutations_extended_{VERSION}.txt", b"Hugo_Symbol\tTumor_Sample_Barcode\nTP53\tGENIE-A-1\n" * 50),
+        "samples": syn.add_file(RELEASE, f"data_clinical_sample_{VERSION}.txt", b"SAMPLE_ID\tONCOTREE_CODE\nGENIE-A-1\tLUAD\n"),
+        "patients": syn.add_file(RELEASE, f"data_clinical_patient_{VERSION}.txt", b"PATIENT_ID\nGENIE-A\n"),
+        "notes": syn.add_file(RELEASE, "release_notes.html", b"<html/>")
+    }
+    syn.add_folder(RELEASE, "synPANELS", "gene_panels")
+    syn.ids["panel"] = syn.add_file("synPANELS", "data_gene_panel_A.txt", b"stable_id: A\ngene_list:\tTP53\n")
+    return syn
+
+def fetch(syn, releases_dir):
+    return SynapseGateway(client=syn, max_jobs=2, releases_dir=str(releases_dir), reference_panel_path=str(REFERENCE_PANEL)).fetch_release_files(RELEASE)
+
+def parser(releases_dir):
+    return ReleaseParser(RELEASE, VERSION, releases_dir=str(releases_dir))
+
+def test_fetch_lists_release_files(syn, tmp_path):
+    manifest = fetch(syn, tmp_path)
+    release_dir = tmp_path / RELEASE
+    assert sorted(manifest["files"]) == sorted(syn.files[file_id][0] for key, file_id in syn.ids.items() if key != "notes")
+    assert all(entry["verified"] for entry in manifest["files"].values())
+    assert not (release_dir / "release_notes.html").exists()
+    assert not (release_dir / ".partial").exists()
+    assert (release_dir / "data_gene_panel_PHS-TRISEQ-V2.txt").exists()
+    assert parser(tmp_path).check_manifest(md5=True) == []
+
+def test_md5_mismatch_is_not_kept(syn, tmp_path):
+    syn.corrupt.add(syn.ids["samples"])
+    manifest = fetch(syn, tmp_path)
+    name = syn.files[syn.ids["samples"]][0]
+    assert not manifest["files"][name]["verified"]
+    assert not (tmp_path / RELEASE / name).exists()
+    with open(tmp_path / RELEASE / "manifest.json") as f:
+        assert not json.load(f)["files"][name]["verified"]
+
+    release = parser(tmp_path)
+    assert release.check_manifest() == [f"{name} was not verified when fetched"]
+    with pytest.raises(ValueError, match=name):
+        release.parse_all()
+    with pytest.raises(ValueError, match=name):
+        release.samples_df
+
+def test_rerun_resumes_only_unfinished_files(syn, tmp_path):
+    syn.fail.add(syn.ids["samples"])
+    syn.interrupt.add(syn.ids["mutations"])
+    fetch(syn, tmp_path)
+    assert len(syn.downloads) == 4
+
+    syn.fail.clear()
+    syn.interrupt.clear()
+    syn.downloads = []
+    manifest = fetch(syn, tmp_path)
+    assert sorted(syn.downloads) == sorted(syn.files[syn.ids[key]][0] for key in ["samples", "mutations"])
+    assert syn.resumed == [syn.files[syn.ids["mutations"]][0]]
+    assert all(entry["verified"] for entry in manifest["files"].values())
+    assert parser(tmp_path).check_manifest(md5=True) == []
+
+    # Up to date files are not downloaded again
+    syn.downloads = []
+    fetch(syn, tmp_path)
+    assert syn.downloads == []
+
+def test_changed_file_is_fetched_again(syn, tmp_path):
+    fetch(syn, tmp_path)
+    with open(tmp_path / RELEASE / "data_gene_panel_A.txt", "a") as f:
+        f.write("junk")
+    assert parser(tmp_path).check_manifest() != []
+
+    syn.update_file(syn.ids["panel"], b"stable_id: A\ngene_list:\tTP53\tKRAS\n")
+    syn.downloads = []
+    manifest = fetch(syn, tmp_path)
+    assert syn.downloads == ["data_gene_panel_A.txt"]
+    assert manifest["files"]["data_gene_panel_A.txt"]["version"] == 2
+    assert parser(tmp_path).check_manifest(md5=True) == []
@@ -0,0 +1,129 @@
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from release_parser import STREAM_BLOCK_SIZE
+from genie_analysis import GenieAnalysis
+from run_report import REPORT
+
+# Variant classifications counted towards TMB, nonsynonymous coding changes
+NONSYNONYMOUS = [
+    'Missense_Mutation',
+    'Nonsense_Mutation',
+    'Nonstop_Mutation',
+    'Frame_Shift_Del',
+    'Frame_Shift_Ins',
+    'In_Frame_Del',
+    'In_Frame_Ins',
+    'Splice_Site',
+    'Translation_Start_Site'
+]
+
+# Mutations per coding megabase, as binned by supp_fig_S7_tmb/plot_tmb_by_center_cancer.R
+BINS = ["Low (<2)", "Mid (2-16)", "High (>16)"]
+LOW_TMB = 2
+HIGH_TMB = 16
+
+# Columns of tmb_by_sample.tsv, plot_tmb_by_center_cancer.R joins it to the clinical samples on SAMPLE_ID
+# so it must not repeat their columns, ex. ONCOTREE_CODE
+R_COLUMNS = ['SAMPLE_ID', 'tmb', 'tmb_bin']
+
+# Oncotree codes binned separately need more samples than this, as in the R script
+MIN_CODE_SAMPLES = 1000
+
+# Tumor mutation burden of every sample in a release, from the MAF and the panels' coding sizes
+#
+# TMB = nonsynonymous mutations in genes the sample's panel covers / megabases of coding sequence on the panel
+# The MAF is streamed block_size bytes at a time and counted per sample, so the full MAF is never loaded.
+# Panel sizes come from ReleaseParser.panel_coding_sizes, samples on panels without a size get no TMB.
+#
+# Writes /app/outputs/VERSION/tmb:
+#   tmb_by_sample.tsv       R_COLUMNS of samples with a TMB, the input of plot_tmb_by_center_cancer.R
+#   tmb_by_sample_full.tsv  SAMPLE_ID, center, ONCOTREE_CODE, SEQ_ASSAY_ID, mutation_count, coding_mb, tmb, tmb_bin
+#                           of every sample, tmb and tmb_bin empty without a panel size
+#   tmb_by_center.tsv       samples per tmb_bin and center
+#   tmb_by_cancer.tsv       samples per tmb_bin and ONCOTREE_CODE, codes with more than MIN_CODE_SAMPLES samples
+class TmbAnalysis:
+    def __init__(self, release_id=None, release_version=None, use_cache=True, engine="pyarrow", block_size=STREAM_BLOCK_SIZE):
+        load_dotenv(dotenv_path='/app/.env', verbose=True)
+        self.genie_analysis = GenieAnalysis(release_id, release_version, use_cache, engine, streaming=True)
+        self.parser = self.genie_analysis.parser
+        self.block_size = block_size
+        self.outpath = f"/app/outputs/{self.parser.release_version}/tmb"
+
+    # Compute and write every TMB table, returns the per sample df
+    def execute(self):
+        tmb_df = self.tmb_by_sample()
+        Path(self.outpath).mkdir(parents=True, exist_ok=True)
+        tmb_df.loc[tmb_df.tmb.notna(), R_COLUMNS].to_csv(f"{self.outpath}/tmb_by_sample.tsv", sep='\t', index=False)
+        tmb_df.to_csv(f"{self.outpath}/tmb_by_sample_full.tsv", sep='\t', index=False)
+        self.bin_counts(tmb_df, 'center').to_csv(f"{self.outpath}/tmb_by_center.tsv", sep='\t', index=False)
+        self.bin_counts(tmb_df, 'ONCOTREE_CODE', MIN_CODE_SAMPLES).to_csv(f"{self.outpath}/tmb_by_cancer.tsv", sep='\t', index=False)
+        print(f"Wrote TMB of {len(tmb_df)} samples to {self.outpath}")
+        return tmb_df
+
+    # Returns an int64 array of TMB mutations per sample, indexed by sample code
+    # Each MAF block is int coded and counted with one bincount over its sample codes
+    def mutation_counts(self):
+        with REPORT.measure("tmb", "mutation_counts") as record:
+            print(f"Counting nonsynonymous mutations in {self.parser.mutations_path}...")
+            counts = np.zeros(len(self.parser.encoding['sample']), dtype=np.int64)
+            rows = 0
+            columns = ['Hugo_Symbol', 'Tumor_Sample_Barcode', 'Variant_Classification']
+            for chunk in self.parser.iter_release_file(self.parser.mutations_path, columns, self.block_size):
+                samples = self.parser.encode('sample', chunk['Tumor_Sample_Barcode'])
+                genes = self.parser.encode('gene', chunk['Hugo_Symbol'])
+                counted = chunk['Variant_Classification'].isin(NONSYNONYMOUS).to_numpy() & self.genie_analysis.in_panel_codes(samples, genes)
+                counts += np.bincount(samples[counted], minlength=len(counts))
+                rows += len(chunk)
+            record["rows"] = rows
+        return counts
+
+    # Returns a df of each sample's TMB and bin, row aligned with samples_df
+    def tmb_by_sample(self):
+        counts = self.mutation_counts()
+        samples_df = self.parser.samples_df
+        sizes = self.parser.panel_coding_sizes.set_index('SEQ_ASSAY_ID')['coding_mb']
+        sample_codes = self.parser.encoded_samples['sample'].to_numpy()
+        df = pd.DataFrame({
+            'SAMPLE_ID': samples_df['SAMPLE_ID'].to_numpy(),
+            'center': samples_df['SAMPLE_ID'].astype(str).str.split('-').str[1].to_numpy(),
+            'ONCOTREE_CODE': samples_df['ONCOTREE_CODE'].to_numpy(),
+            'SEQ_ASSAY_ID': samples_df['SEQ_ASSAY_ID'].to_numpy(),
+            'mutation_count': np.where(sample_codes >= 0, counts[sample_codes], 0) # unmapped samples (code -1) have no mutations
+        })
+        df['coding_mb'] = df['SEQ_ASSAY_ID'].astype(str).str.upper().map(sizes).to_numpy(dtype=float)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df['tmb'] = np.where(df.coding_mb > 0, df.mutation_count / df.coding_mb, np.nan)
+        df['tmb_bin'] = self.tmb_bins(df.tmb.to_numpy())
+
+        unsized = df.loc[df.tmb.isna(), 'SEQ_ASSAY_ID'].dropna().unique()
+        if len(unsized) > 0:
+            print(f"No coding size for {len(unsized)} panels, {int(df.tmb.isna().sum())} samples have no TMB: {', '.join(map(str, unsized[:10]))}")
+        return df
+
+    # Returns the BINS label of each TMB, None where the TMB is unknown
+    def tmb_bins(self, tmb):
+        low, mid, high = BINS
+        return np.select([tmb < LOW_TMB, tmb > HIGH_TMB, tmb >= LOW_TMB], [low, high, mid], default=None)
+
+    # Returns the number of samples per (tmb_bin, column) for samples with a TMB
+    # Values of column with min_samples or fewer samples with a TMB, or missing, are left out,
+    # as the R script counts only the samples in tmb_by_sample.tsv
+    def bin_counts(self, tmb_df, column, min_samples=0):
+        sized = tmb_df.loc[tmb_df['tmb_bin'].notna()]
+        counts = sized[column].value_counts()
+        keep = counts.index[counts > min_samples]
+        binned = sized.loc[sized[column].isin(keep)]
+        df = binned.groupby(['tmb_bin', column]).size().rename('n').reset_index()
+        df['tmb_bin'] = pd.Categorical(df['tmb_bin'], categories=BINS)
+        return df.sort_values(['tmb_bin', column]).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute per sample tumor mutation burden of a release")
+    parser.add_argument("--release-id", default=None, help="defaults to SYNAPSE_RELEASE_ID")
+    parser.add_argument("--release-version", default=None, help="defaults to SYNAPSE_RELEASE_VERSION")
+    args = parser.parse_args()
+    TmbAnalysis(args.release_id, args.release_version).execute()